@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Keep test runs away from the checked-in memory files: the app's
+# MemoryModule is created at import time, so point it elsewhere first.
+_data_dir = tempfile.mkdtemp(prefix="geny-test-")
+os.environ.setdefault("GENY_MEMORY_DB", os.path.join(_data_dir, "memory.db"))
+os.environ.setdefault("GENY_MEMORY_JSON", os.path.join(_data_dir, "memory.json"))
@@ -1,5 +1,7 @@
+import asyncio
 import logging
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -15,7 +17,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger("geny_backend")
 
-app = FastAPI()
+
+def _log_preload_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Preloading the GenAI clients failed", exc_info=task.exception())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import the heavy Google client libraries in the background so the
+    # first /chat request doesn't pay for it.
+    from geny import gemini_api as _g
+
+    task = asyncio.create_task(asyncio.to_thread(_g.preload_clients))
+    task.add_done_callback(_log_preload_failure)
+    app.state.genai_preload = task
+    try:
+        yield
+    finally:
+        task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS for all origins (development convenience)
 app.add_middleware(
@@ -58,11 +81,12 @@ try:
     logger.info(
         "Startup GenAI status: api_key_present=%s, genai_module_available=%s",
         bool(getattr(_g, "API_KEY", None)),
-        getattr(_g, "genai", None) is not None,
+        _g.genai_available(),
     )
 except Exception as e:
     logger.exception("Failed to import geny.gemini_api at startup: %s", e)
 
+
 # Log whether the IMPORT_ADMIN_TOKEN is present at process startup (do not log the value)
 _token, _source = _get_import_token_source()
 logger.info("IMPORT_ADMIN_TOKEN source at startup: %s", _source)
@@ -89,7 +113,7 @@ async def genai_status():
 
         return {
             "api_key_present": bool(getattr(_g, "API_KEY", None)),
-            "genai_module_available": getattr(_g, "genai", None) is not None,
+            "genai_module_available": _g.genai_available(),
         }
     except Exception as e:
         logger.exception("Failed to determine genai status: %s", e)
@@ -37,3 +37,32 @@ def test_sync_and_summary():
     r2 = client.get("/summary")
     assert r2.status_code == 200
     assert "summary" in r2.json()
+
+
+def _run_lifespan_until(done):
+    import time
+
+    with TestClient(app):
+        deadline = time.monotonic() + 2
+        while not done() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+def test_lifespan_preloads_genai_clients(monkeypatch):
+    from geny import gemini_api
+
+    calls = []
+    monkeypatch.setattr(gemini_api, "preload_clients", lambda: calls.append(1))
+    _run_lifespan_until(lambda: calls)
+    assert calls == [1]
+
+
+def test_failed_genai_preload_is_logged(monkeypatch, caplog):
+    from geny import gemini_api
+
+    def broken_preload():
+        raise ImportError("no google clients")
+
+    monkeypatch.setattr(gemini_api, "preload_clients", broken_preload)
+    _run_lifespan_until(lambda: "Preloading the GenAI clients failed" in caplog.text)
+    assert "Preloading the GenAI clients failed" in caplog.text
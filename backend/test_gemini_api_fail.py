@@ -1,4 +1,5 @@
 import asyncio
+from collections import OrderedDict
 
 from geny import gemini_api
 
@@ -22,3 +23,88 @@ def test_gemini_circuit_breaker(monkeypatch):
     # Run the wrapper; it should catch underlying exceptions and return an error string
     reply = asyncio.run(gemini_api.generate_reply("test prompt", max_retries=1))
     assert reply.startswith("[Gemini") or isinstance(reply, str)
+
+
+def test_retries_stop_once_the_breaker_opens(monkeypatch):
+    calls = []
+
+    class FailingModel:
+        def generate_content(self, prompt):
+            calls.append(prompt)
+            raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(gemini_api, "API_KEY", "fake")
+    monkeypatch.setattr(gemini_api, "_breakers", OrderedDict())
+    monkeypatch.setattr(gemini_api, "_get_model", FailingModel)
+    monkeypatch.setattr(gemini_api, "_jittered_backoff", lambda attempt: 0)
+
+    reply = asyncio.run(gemini_api._call_gemini("p", max_retries=5, tenant_id="a"))
+    # fail_threshold=3 opens the breaker; the last two retries never go out
+    assert len(calls) == 3
+    assert reply == "[Gemini error] Circuit open - upstream unavailable"
+
+
+def test_recovery_wakes_retries_sleeping_in_backoff():
+    breaker = gemini_api.CircuitBreaker()
+
+    async def run():
+        sleeper = asyncio.ensure_future(breaker.backoff_sleep(5))
+        # let the retry start waiting
+        await asyncio.sleep(0.01)
+        breaker.signal_recovery()
+        await asyncio.wait_for(sleeper, timeout=1)
+
+    asyncio.run(run())
+
+
+def test_one_tenants_failures_leave_other_tenants_breakers_closed(monkeypatch):
+    class Model:
+        def generate_content(self, prompt):
+            if prompt.endswith("from a"):
+                raise RuntimeError("upstream down")
+            return "ok"
+
+    monkeypatch.setattr(gemini_api, "API_KEY", "fake")
+    monkeypatch.setattr(gemini_api, "_breakers", OrderedDict())
+    monkeypatch.setattr(gemini_api, "_get_model", Model)
+    monkeypatch.setattr(gemini_api, "_jittered_backoff", lambda attempt: 0)
+
+    async def run():
+        await gemini_api._call_gemini("from a", max_retries=3, tenant_id="a")
+        return await gemini_api._call_gemini("from b", tenant_id="b")
+
+    assert asyncio.run(run()) == "ok"
+    assert not gemini_api._get_breaker("a").allow_request()
+    assert gemini_api._get_breaker("b").allow_request()
+
+
+def test_recovery_wakes_only_the_same_tenants_retries(monkeypatch):
+    monkeypatch.setattr(gemini_api, "_breakers", OrderedDict())
+
+    async def run():
+        a = gemini_api._get_breaker("a")
+        b = gemini_api._get_breaker("b")
+        sleep_a = asyncio.ensure_future(a.backoff_sleep(5))
+        sleep_b = asyncio.ensure_future(b.backoff_sleep(5))
+        # let both retries start waiting
+        await asyncio.sleep(0.01)
+        a.signal_recovery()
+        await asyncio.wait_for(sleep_a, timeout=1)
+        await asyncio.sleep(0.05)
+        b_woke = sleep_b.done()
+        sleep_b.cancel()
+        return b_woke
+
+    assert asyncio.run(run()) is False
+
+
+def test_breakers_are_kept_for_the_most_recent_tenants_only(monkeypatch):
+    monkeypatch.setattr(gemini_api, "_breakers", OrderedDict())
+    monkeypatch.setattr(gemini_api, "BREAKER_CACHE_SIZE", 2)
+
+    a = gemini_api._get_breaker("a")
+    gemini_api._get_breaker("b")
+    assert gemini_api._get_breaker("a") is a
+    gemini_api._get_breaker("c")
+    # "b" was the least recently used
+    assert list(gemini_api._breakers) == ["a", "c"]
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from geny import geny_brain
+from geny.geny_brain import GenyBrain
+from memory import MemoryModule
+
+
+def _brain_with_counted_saves(tmp_path, monkeypatch):
+    brain = GenyBrain()
+    brain.memory_module = MemoryModule(
+        db_path=str(tmp_path / "memory.db"), json_path=str(tmp_path / "memory.json")
+    )
+    brain.memory = brain.memory_module.load_memory_dict()
+    saves = []
+    real_save = brain.memory_module.save_memory_dict
+
+    def counted_save(mem):
+        saves.append(len(mem["interactions"]))
+        real_save(mem)
+
+    monkeypatch.setattr(brain.memory_module, "save_memory_dict", counted_save)
+    return brain, saves
+
+
+def test_dirty_marks_within_the_interval_coalesce_into_one_save(tmp_path, monkeypatch):
+    monkeypatch.setattr(geny_brain, "SAVE_INTERVAL_SEC", 0.1)
+    brain, saves = _brain_with_counted_saves(tmp_path, monkeypatch)
+
+    async def run():
+        for i in range(10):
+            brain.memory["interactions"].append({"message": f"m{i}"})
+            brain._mark_dirty()
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.3)
+
+    asyncio.run(run())
+    # The first mark saves at once; the rest wait out the interval together
+    assert len(saves) == 2 and saves[-1] == 10
+    reloaded = brain.memory_module.load_memory_dict()
+    assert len(reloaded["interactions"]) == 10
+
+
+def test_flush_writes_changes_still_waiting_for_a_save(tmp_path, monkeypatch):
+    brain, saves = _brain_with_counted_saves(tmp_path, monkeypatch)
+    brain.flush()
+    assert saves == []
+
+    brain.memory["interactions"].append({"message": "pending"})
+    brain._dirty_count = 1
+    brain.flush()
+    assert saves == [1]
+    reloaded = brain.memory_module.load_memory_dict()
+    assert reloaded["interactions"] == [{"message": "pending"}]
+
+
+def test_lookup_cache_is_per_brain_and_cleared_on_reload():
+    first, second = GenyBrain(), GenyBrain()
+    first.lookup_offline("imagenet")
+    # Spelling variants normalize to the same cached query
+    first.lookup_offline("  ImageNet ")
+    assert first._lookup_cached.cache_info().hits == 1
+    assert second._lookup_cached.cache_info().currsize == 0
+
+    first._load_offline_libs()
+    assert first._lookup_cached.cache_info().currsize == 0
+
+
+def _reply_to_gemini_text(monkeypatch, text, brain=None):
+    async def fake_gemini(prompt):
+        return text
+
+    monkeypatch.setattr(geny_brain, "gemini_generate_reply", fake_gemini)
+    # A creator alias sends the message on to Gemini
+    brain = brain or GenyBrain()
+    return asyncio.run(brain.generate_reply("Andreas wonders about this"))
+
+
+def test_gemini_markup_is_escaped_in_replies(monkeypatch):
+    reply = _reply_to_gemini_text(
+        monkeypatch, "<script>alert(1)</script>\nAnd a second line"
+    )
+    assert "<script>" not in reply
+    assert "&lt;script&gt;alert(1)&lt;/script&gt;<br>And a second line" in reply
+
+
+def test_gemini_code_is_escaped_inside_pre(monkeypatch):
+    reply = _reply_to_gemini_text(monkeypatch, "if a < b:\n    print(a)")
+    assert "<pre>if a &lt; b:\n    print(a)</pre>" in reply
+
+
+def test_repeat_note_escapes_styles_and_diary_entry(monkeypatch):
+    brain = GenyBrain()
+    brain.world["recent_replies"] = ["Same answer"]
+    brain.world["user_styles"] = ["<3"]
+    brain.world["diary"] = [{"date": "2024-01-01", "entry": "<b>bold</b>"}]
+    reply = _reply_to_gemini_text(monkeypatch, "Same answer", brain)
+    assert "<br>&lt;3 <i>I remember we talked about:</i> " in reply
+    assert "'&lt;b&gt;bold&lt;/b&gt;'<br>" in reply
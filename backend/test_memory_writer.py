@@ -0,0 +1,197 @@
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import memory
+from memory import MemoryModule
+
+
+def test_queued_interactions_are_visible_to_reads(tmp_path):
+    mem = MemoryModule(
+        db_path=str(tmp_path / "memory.db"), json_path=str(tmp_path / "memory.json")
+    )
+    for i in range(50):
+        mem.save_interaction(f"hello {i}", f"reply {i}")
+
+    last = mem.get_last_n(50)
+    assert len(last) == 50
+    assert last[-1]["message"] == "hello 49"
+    assert mem.search("hello 7")[0]["reply"] == "reply 7"
+    mem.export_json(str(tmp_path / "export.json"))
+    with open(tmp_path / "export.json", encoding="utf-8") as f:
+        assert len(json.load(f)["interactions"]) == 50
+
+
+def test_reads_include_queued_rows_without_waiting_for_the_writer(
+    tmp_path, monkeypatch
+):
+    mem = MemoryModule(
+        db_path=str(tmp_path / "memory.db"), json_path=str(tmp_path / "memory.json")
+    )
+    mem.save_interaction("written", "reply 0")
+    mem.flush()
+    release = threading.Event()
+    real_write_batch = mem._write_batch
+
+    def stalled_write_batch(rows):
+        release.wait(5)
+        real_write_batch(rows)
+
+    monkeypatch.setattr(mem, "_write_batch", stalled_write_batch)
+    mem.save_interaction("queued 100%", "reply 1")
+    try:
+        assert [it["message"] for it in mem.get_last_n(5)] == ["written", "queued 100%"]
+        assert [it["message"] for it in mem.get_last_n(1)] == ["queued 100%"]
+        assert [it["reply"] for it in mem.search("QUEUED")] == ["reply 1"]
+        assert [it["reply"] for it in mem.search("reply")] == ["reply 1", "reply 0"]
+        assert mem.search("queued 1_0%") and not mem.search("queued 1_1")
+    finally:
+        release.set()
+    mem.flush()
+    assert [it["message"] for it in mem.get_last_n(5)] == ["written", "queued 100%"]
+
+
+def test_repeated_saves_mirror_each_interaction_into_sqlite_once(tmp_path):
+    mem = MemoryModule(
+        db_path=str(tmp_path / "memory.db"), json_path=str(tmp_path / "memory.json")
+    )
+    data = mem.load_memory_dict()
+    data["interactions"] += [
+        {"timestamp": f"t{i}", "message": f"m{i}", "reply": f"r{i}"} for i in range(2)
+    ]
+    mem.save_memory_dict(data)
+    mem.save_memory_dict(data)
+    data["interactions"].append({"timestamp": "t2", "message": "m2", "reply": "r2"})
+    mem.save_memory_dict(data)
+
+    assert [it["message"] for it in mem.get_last_n(10)] == ["m0", "m1", "m2"]
+
+    # A replaced list is mirrored from the start; rows already there are skipped
+    data["interactions"] = data["interactions"][1:] + [
+        {"timestamp": "t3", "message": "m3", "reply": "r3"}
+    ]
+    mem.save_memory_dict(data)
+    assert [it["message"] for it in mem.get_last_n(10)] == ["m0", "m1", "m2", "m3"]
+
+
+def test_interactions_appended_during_the_mirror_reach_sqlite(tmp_path):
+    mem = MemoryModule(
+        db_path=str(tmp_path / "memory.db"), json_path=str(tmp_path / "memory.json")
+    )
+    data = mem.load_memory_dict()
+    data["interactions"].append({"timestamp": "t1", "message": "first"})
+    real_transaction = mem._pool.transaction
+
+    @contextmanager
+    def append_during_transaction():
+        with real_transaction() as conn:
+            if len(data["interactions"]) == 1:
+                data["interactions"].append({"timestamp": "t2", "message": "late"})
+            yield conn
+
+    mem._pool.transaction = append_during_transaction
+    mem.save_memory_dict(data)
+    mem.save_memory_dict(data)
+
+    assert [it["message"] for it in mem.get_last_n(10)] == ["first", "late"]
+
+
+def test_interactions_round_trip_through_jsonl_log(tmp_path):
+    json_path = tmp_path / "memory.json"
+    # A memory file from before the log existed keeps interactions inline
+    json_path.write_text(
+        json.dumps({"world": {}, "interactions": [{"message": "old"}]}),
+        encoding="utf-8",
+    )
+    mem = MemoryModule(db_path=str(tmp_path / "memory.db"), json_path=str(json_path))
+    data = mem.load_memory_dict()
+    assert data["interactions"] == [{"message": "old"}]
+
+    data["interactions"].append({"message": "new"})
+    mem.save_memory_dict(data)
+    data["interactions"].append({"message": "newer"})
+    mem.save_memory_dict(data)
+
+    assert "interactions" not in json.loads(json_path.read_text(encoding="utf-8"))
+    reloaded = MemoryModule(
+        db_path=str(tmp_path / "memory.db"), json_path=str(json_path)
+    ).load_memory_dict()
+    assert [it["message"] for it in reloaded["interactions"]] == [
+        "old",
+        "new",
+        "newer",
+    ]
+
+
+def test_interactions_appended_during_a_save_go_out_with_the_next(
+    tmp_path, monkeypatch
+):
+    json_path = tmp_path / "memory.json"
+    mem = MemoryModule(db_path=str(tmp_path / "memory.db"), json_path=str(json_path))
+    data = mem.load_memory_dict()
+    data["interactions"].append({"message": "first"})
+    mem.save_memory_dict(data)
+
+    real_dumps = memory._dumps
+
+    def append_during_write(obj, *args):
+        # The event loop keeps adding replies while a worker thread saves
+        if not any(it["message"] == "late" for it in data["interactions"]):
+            data["interactions"].append({"message": "late"})
+        return real_dumps(obj, *args)
+
+    monkeypatch.setattr(memory, "_dumps", append_during_write)
+    data["interactions"].append({"message": "second"})
+    mem.save_memory_dict(data)
+    mem.save_memory_dict(data)
+
+    reloaded = MemoryModule(
+        db_path=str(tmp_path / "memory.db"), json_path=str(json_path)
+    ).load_memory_dict()
+    assert [it["message"] for it in reloaded["interactions"]] == [
+        "first",
+        "second",
+        "late",
+    ]
+
+
+def test_inline_interactions_survive_a_failed_log_write(tmp_path, monkeypatch):
+    json_path = tmp_path / "memory.json"
+    json_path.write_text(
+        json.dumps({"world": {}, "interactions": [{"message": "old"}]}),
+        encoding="utf-8",
+    )
+    mem = MemoryModule(db_path=str(tmp_path / "memory.db"), json_path=str(json_path))
+    data = mem.load_memory_dict()
+    real_write = memory._atomic_write_json
+
+    def fail_log_write(path, payload):
+        if path == mem.interactions_path:
+            raise OSError("disk full")
+        real_write(path, payload)
+
+    monkeypatch.setattr(memory, "_atomic_write_json", fail_log_write)
+    data["world"]["day"] = 2
+    mem.save_memory_dict(data)
+
+    saved = json.loads(json_path.read_text(encoding="utf-8"))
+    assert saved["interactions"] == [{"message": "old"}]
+
+
+def test_torn_last_log_line_is_skipped_on_load(tmp_path):
+    json_path = tmp_path / "memory.json"
+    mem = MemoryModule(db_path=str(tmp_path / "memory.db"), json_path=str(json_path))
+    data = mem.load_memory_dict()
+    data["interactions"].append({"message": "kept"})
+    mem.save_memory_dict(data)
+    with open(mem.interactions_path, "ab") as f:
+        f.write(b'{"message": "to')
+
+    reloaded = MemoryModule(
+        db_path=str(tmp_path / "memory.db"), json_path=str(json_path)
+    ).load_memory_dict()
+    assert reloaded["interactions"] == [{"message": "kept"}]
@@ -55,3 +55,23 @@ def test_lookup_language_detection(brain):
     # English question triggers English bonus
     result = brain.lookup_offline("What is ImageNet?")
     assert result and ("visual database" in result.lower() or "image" in result.lower())
+
+
+def test_concurrent_first_lookups_wait_for_the_load(monkeypatch):
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from geny import geny_brain
+
+    real_loads = geny_brain._loads
+
+    def slow_loads(data):
+        # Widen the window in which other threads arrive mid-load
+        time.sleep(0.01)
+        return real_loads(data)
+
+    monkeypatch.setattr(geny_brain, "_loads", slow_loads)
+    fresh = GenyBrain()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(fresh.lookup_offline, ["imagenet"] * 8))
+    assert all(r and "visual database" in r.lower() for r in results)
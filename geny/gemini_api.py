@@ -10,32 +10,75 @@ Behavior:
 from __future__ import annotations
 
 import asyncio
+import contextvars
+import importlib
+import importlib.util
 import logging
 import os
 import random
+import threading
 import time
-from typing import Optional
-
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
-    # Allows offline tests to run without Google Gemini installed
-from google.cloud import secretmanager
+from collections import OrderedDict
+from typing import Final, Optional
 
 logger = logging.getLogger(__name__)
 
+# The Google client libraries are slow to import, so they are loaded on first
+# use (or ahead of time via preload_clients()) rather than at module import.
+# They stay reachable as module attributes, e.g. `gemini_api.genai`.
+_LAZY_MODULES: Final = {
+    "genai": "google.generativeai",
+    "secretmanager": "google.cloud.secretmanager",
+}
+
+
+def _lazy_import(name: str):
+    if name not in globals():
+        try:
+            globals()[name] = importlib.import_module(_LAZY_MODULES[name])
+        except ImportError:
+            # Allows offline tests to run without the Google clients installed
+            globals()[name] = None
+    return globals()[name]
+
+
+def __getattr__(name: str):
+    if name in _LAZY_MODULES:
+        return _lazy_import(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def preload_clients() -> None:
+    """Import the Google client libraries ahead of the first request."""
+    for name in _LAZY_MODULES:
+        _lazy_import(name)
+
+
+def genai_available() -> bool:
+    """Whether google.generativeai is installed, without importing it."""
+    if "genai" in globals():
+        return globals()["genai"] is not None
+    try:
+        return importlib.util.find_spec(_LAZY_MODULES["genai"]) is not None
+    except ImportError:
+        return False
+
+
 # Configuration: model and secret names are configurable via environment.
 MODEL = os.getenv("GENAI_MODEL", "models/gemini-2.5-flash")
 SECRET_PROJECT = os.getenv("GENAI_SECRET_PROJECT", "geny-469516")
 SECRET_NAME = os.getenv("GENAI_SECRET_NAME", "genai-api-key")
 
+# Offline fallback reply, wrapped around the last line of the prompt.
+_FALLBACK_PREFIX = "I think... "
+_FALLBACK_SUFFIX = " I'm not connected to Gemini right now, but I'm here to listen and help! What would you like to talk about?"
+
 
 def _get_api_key_from_secret_manager(
     project: str = SECRET_PROJECT, secret_name: str = SECRET_NAME
 ) -> Optional[str]:
     try:
-        client = secretmanager.SecretManagerServiceClient()
+        client = _lazy_import("secretmanager").SecretManagerServiceClient()
         name = f"projects/{project}/secrets/{secret_name}/versions/latest"
         response = client.access_secret_version(request={"name": name})
         payload = response.payload.data.decode("utf-8")
@@ -55,29 +98,36 @@ try:
     logger.info(
         "GENAI API key present: %s, google.generativeai available: %s",
         bool(API_KEY),
-        genai is not None,
+        genai_available(),
     )
 except Exception:
     pass
 
 
 class CircuitBreaker:
-    CLOSED = "closed"
-    OPEN = "open"
-    HALF = "half_open"
-
-    def __init__(self, fail_threshold: int = 5, recovery_timeout: int = 60):
-        self.fail_threshold = fail_threshold
-        self.recovery_timeout = recovery_timeout
-        self._state = CircuitBreaker.CLOSED
-        self._fail_count = 0
-        self._opened_at = 0
-
-    def record_success(self):
+    CLOSED: Final = "closed"
+    OPEN: Final = "open"
+    HALF: Final = "half_open"
+
+    def __init__(self, fail_threshold: int = 5, recovery_timeout: int = 60) -> None:
+        self.fail_threshold: int = fail_threshold
+        self.recovery_timeout: int = recovery_timeout
+        self._state: str = CircuitBreaker.CLOSED
+        self._fail_count: int = 0
+        self._opened_at: float = 0.0
+        # Set when this breaker recovers so its retries sleeping in backoff
+        # wake up early. Bound to the event loop that created it.
+        self._recovery_event: asyncio.Event | None = None
+        self._recovery_loop: asyncio.AbstractEventLoop | None = None
+
+    def record_success(self) -> bool:
+        """Close the breaker. Returns True if it was not already closed."""
+        recovered = self._state != CircuitBreaker.CLOSED
         self._fail_count = 0
         self._state = CircuitBreaker.CLOSED
+        return recovered
 
-    def record_failure(self):
+    def record_failure(self) -> None:
         self._fail_count += 1
         if self._fail_count >= self.fail_threshold:
             self._state = CircuitBreaker.OPEN
@@ -91,62 +141,147 @@ class CircuitBreaker:
             return False
         return True
 
+    def _get_recovery_event(self) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        if self._recovery_event is None or self._recovery_loop is not loop:
+            self._recovery_event = asyncio.Event()
+            self._recovery_loop = loop
+        return self._recovery_event
+
+    def signal_recovery(self) -> None:
+        """Wake the retries waiting in backoff_sleep on this breaker."""
+        event = self._get_recovery_event()
+        event.set()
+        event.clear()
+
+    async def backoff_sleep(self, delay: float) -> None:
+        """Sleep for delay seconds, or until this breaker recovers."""
+        try:
+            await asyncio.wait_for(self._get_recovery_event().wait(), timeout=delay)
+        except TimeoutError:
+            pass
+
+
+# One breaker per tenant so a misbehaving tenant doesn't trip it for everyone.
+# The tenant defaults to the `current_tenant` context variable. Breakers are
+# kept for the BREAKER_CACHE_SIZE most recently used tenants; an evicted
+# tenant starts over with a closed breaker.
+DEFAULT_TENANT = "default"
+BREAKER_CACHE_SIZE = int(os.getenv("GENAI_BREAKER_CACHE_SIZE", "1024"))
+current_tenant: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "geny_tenant", default=DEFAULT_TENANT
+)
+_breakers: OrderedDict[str, CircuitBreaker] = OrderedDict()
+_breakers_lock = threading.Lock()
+
+
+def _get_breaker(key: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(
+                fail_threshold=3, recovery_timeout=30
+            )
+            if len(_breakers) > BREAKER_CACHE_SIZE:
+                _breakers.popitem(last=False)
+        else:
+            _breakers.move_to_end(key)
+    return breaker
+
+
+# Process-wide model instance. genai.configure() rebuilds the SDK's transport
+# clients, so configuring once and reusing the model keeps connections warm.
+_model = None
+_model_lock = threading.Lock()
+
+
+def _get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                genai = _lazy_import("genai")
+                genai.configure(api_key=API_KEY)
+                _model = genai.GenerativeModel(MODEL)
+    return _model
 
-_circuit = CircuitBreaker(fail_threshold=3, recovery_timeout=30)
+
+# RNG used for backoff jitter. Jitter doesn't need to be unpredictable, only
+# spread out; set a seeded random.Random() here to make it reproducible.
+# Unset, the shared _jitter_rng is used.
+backoff_rng: contextvars.ContextVar[random.Random | None] = contextvars.ContextVar(
+    "geny_backoff_rng", default=None
+)
+_jitter_rng = random.Random()
 
 
 def _jittered_backoff(attempt: int, base: float = 0.5, cap: float = 10.0) -> float:
     expo = min(cap, base * (2**attempt))
-    return expo * (0.5 + random.random() * 0.5)
+    rng = backoff_rng.get() or _jitter_rng
+    return expo * (0.5 + rng.random() * 0.5)
+
+
+_SYSTEM_PROMPT: Final = (
+    "You are Geny, an empathetic and intelligent AI assistant. Reply briefly and helpfully in English."
+)
+
 
+def _blocking_generate(full_prompt: str):
+    response = _get_model().generate_content(full_prompt)
+    # Gemini returns a response object with .text or .candidates[0].text
+    if hasattr(response, "text"):
+        return response.text
+    elif hasattr(response, "candidates") and response.candidates:
+        return response.candidates[0].text
+    return str(response)
 
-async def _call_gemini(prompt: str, max_retries: int = 3, timeout: int = None) -> str:
+
+async def _call_gemini(
+    prompt: str,
+    max_retries: int = 3,
+    timeout: float | None = None,
+    tenant_id: str | None = None,
+) -> str:
     if not API_KEY:
         msg = "[Gemini error] Missing API key. Set GENAI_API_KEY or configure Secret Manager."
         logger.error(msg)
         return msg
 
-    if not _circuit.allow_request():
+    circuit = _get_breaker(tenant_id or current_tenant.get())
+    if not circuit.allow_request():
         logger.warning("Circuit breaker open; failing fast")
         return "[Gemini error] Circuit open - upstream unavailable"
 
-    system_prompt = "You are Geny, an empathetic and intelligent AI assistant. Reply briefly and helpfully in English."
+    full_prompt = f"{_SYSTEM_PROMPT}\n{prompt}"
 
-    last_err = None
+    last_err: BaseException | None = None
     for attempt in range(max_retries):
-
-        def blocking_call():
-            genai.configure(api_key=API_KEY)
-            model = genai.GenerativeModel(MODEL)
-            response = model.generate_content(f"{system_prompt}\n{prompt}")
-            # Gemini returns a response object with .text or .candidates[0].text
-            if hasattr(response, "text"):
-                return response.text
-            elif hasattr(response, "candidates") and response.candidates:
-                return response.candidates[0].text
-            return str(response)
-
+        # Earlier attempts may have opened the breaker
+        if attempt and not circuit.allow_request():
+            logger.warning("Circuit breaker opened; giving up on retries")
+            return "[Gemini error] Circuit open - upstream unavailable"
         try:
             if timeout:
                 text = await asyncio.wait_for(
-                    asyncio.to_thread(blocking_call), timeout=timeout
+                    asyncio.to_thread(_blocking_generate, full_prompt), timeout=timeout
                 )
             else:
-                text = await asyncio.to_thread(blocking_call)
+                text = await asyncio.to_thread(_blocking_generate, full_prompt)
             # Ensure we always return a string
             try:
                 text = "" if text is None else str(text)
             except Exception:
                 text = ""
             logger.info("Gemini reply received (len=%d)", len(text))
-            _circuit.record_success()
+            if circuit.record_success():
+                circuit.signal_recovery()
             return text
         except asyncio.TimeoutError as e:
             last_err = e
             logger.exception(
                 "Gemini API timeout on attempt %d: %s", attempt + 1, str(e)
             )
-            _circuit.record_failure()
+            circuit.record_failure()
         except Exception as e:
             last_err = e
             err_text = str(e)
@@ -158,40 +293,48 @@ async def _call_gemini(prompt: str, max_retries: int = 3, timeout: int = None) -
                 or "API key not valid" in err_text
                 or "Unauthorized" in err_text
             ):
-                _circuit.record_failure()
+                circuit.record_failure()
                 return f"[Gemini 401] {err_text}"
-            _circuit.record_failure()
+            circuit.record_failure()
 
         backoff = _jittered_backoff(attempt)
-        await asyncio.sleep(backoff)
+        await circuit.backoff_sleep(backoff)
 
     return f"[Gemini error] Failed after {max_retries} attempts: {last_err}"
 
 
 async def generate_reply(
-    prompt: str, *, max_retries: int = 3, timeout: Optional[float] = 15
+    prompt: str,
+    *,
+    max_retries: int = 3,
+    timeout: float | None = 15,
+    tenant_id: str | None = None,
 ) -> str:
     """Public async function used by the app.
 
     If an API key is configured (env or Secret Manager) this will call Gemini.
     Otherwise it falls back to a safe local echo reply for offline/dev.
+    `tenant_id` selects the circuit breaker; it defaults to `current_tenant`.
     """
     # If we have an API key, call the real Gemini client
     if API_KEY:
-        result = await _call_gemini(prompt, max_retries=max_retries, timeout=timeout)
+        result = await _call_gemini(
+            prompt, max_retries=max_retries, timeout=timeout, tenant_id=tenant_id
+        )
         try:
             return str(result) if result is not None else ""
         except Exception:
             return ""
 
-    await asyncio.sleep(0)
-    # Extract user message
+    # Extract user message: the last non-blank line, without splitting the prompt
     try:
-        parts = [p.strip() for p in prompt.splitlines() if p.strip()]
-        user_msg = parts[-1] if parts else prompt
+        tail = prompt.rstrip()
+        # Only the text after the last "\n" is split, so "\r" and the other
+        # line breaks splitlines() honours still end a line
+        lines = tail[tail.rfind("\n") + 1 :].splitlines()
+        user_msg = lines[-1].strip() if lines else prompt
     except Exception:
         user_msg = prompt
 
     # Friendly, personal fallback
-    reply = f"I think... {user_msg} I'm not connected to Gemini right now, but I'm here to listen and help! What would you like to talk about?"
-    return reply
+    return _FALLBACK_PREFIX + user_msg + _FALLBACK_SUFFIX
@@ -1,7 +1,8 @@
 """A small, persistent AI "brain" for Geny that wraps the Gemini API.
 
 Behavior:
-- Loads/saves a JSON memory file (`memory.json`) containing interactions.
+- Loads/saves a JSON memory file (`memory.json`), with interactions kept in an
+  append-only log beside it.
 - Provides async generate_reply that delegates to geny.gemini_api.generate_reply,
   records the interaction with timestamp, and persists memory safely.
 - Provides a simple generate_daily_summary that uses stored interactions.
@@ -12,23 +13,283 @@ This is intentionally lightweight and synchronous-safe for local testing.
 from __future__ import annotations
 
 import asyncio
-import json
+import atexit
+import html
+import logging
 import os
-import tempfile
-from dataclasses import dataclass, field
+import random
+import re
+import sys
+import threading
 from datetime import datetime
+from difflib import SequenceMatcher
+from functools import lru_cache
+from operator import itemgetter
 from typing import Any, Dict, List
 
+try:
+    from rapidfuzz import fuzz
+except ImportError:
+    fuzz = None
+
 from geny.gemini_api import generate_reply as gemini_generate_reply
-from memory import MemoryModule
+from memory import (
+    MemoryModule,
+    _append_jsonl,
+    _atomic_write_json,
+    _loads,
+    _utcnow,
+)
+
+logger = logging.getLogger("geny_backend.geny_brain")
+
+# Debounced persistence: memory is flushed at most every SAVE_INTERVAL_SEC,
+# or sooner once SAVE_MAX_DIRTY mutations have piled up.
+SAVE_INTERVAL_SEC = float(os.getenv("GENY_SAVE_INTERVAL_SEC", "2.0"))
+SAVE_MAX_DIRTY = int(os.getenv("GENY_SAVE_MAX_DIRTY", "32"))
+# Normalized queries whose lookup_offline answers are kept per brain.
+LOOKUP_CACHE_SIZE = int(os.getenv("GENY_LOOKUP_CACHE_SIZE", "2048"))
+
+# Patterns and keyword tables used on every reply, compiled once.
+_QUERY_PREFIX_RE = re.compile(r"^(what is|define|explain)\s+")
+_QUERY_NONWORD_RE = re.compile(r"[^\wüéèáàâçñøÆØ]+")
+_DATASET_INDICATORS = (
+    "imagenet",
+    "coco",
+    "squad",
+    "wmt",
+    "dataset",
+    "data",
+    "object detection",
+    "visual",
+    "nlp",
+    "humaneval",
+    "python programming",
+)
+_CODE_KEYWORDS = (
+    "python",
+    "java",
+    "shell",
+    "sql",
+    "go",
+    "rust",
+    "c",
+    "training",
+    "loop",
+    "snippet",
+    "example",
+    "transformers",
+)
+_EMOJI_RE = re.compile(
+    r"[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F1E0-\U0001F1FF]"
+)
+_SLANG_RE = re.compile(r"\b(lol|haha|asap|wtf|brb|tbh|omg|nice|wow|<3)\b")
+
+
+def _matcher(a: str) -> SequenceMatcher | None:
+    """A difflib matcher with a as its cached second sequence, for _similar.
+
+    None when rapidfuzz is installed, since it needs no per-query state.
+    """
+    if fuzz is not None:
+        return None
+    return SequenceMatcher(None, b=a)
+
+
+def _similar(
+    a: str, b: str, cutoff: float, matcher: SequenceMatcher | None = None
+) -> bool:
+    """True if the a/b similarity ratio (0..1) is above cutoff.
+
+    Uses rapidfuzz's C implementation when installed; otherwise difflib,
+    trying the length bound and quick_ratio() before the full ratio().
+    Comparing one string against many, pass _matcher(a) so the character
+    counts of a are built once instead of per pair. The upper bounds are
+    symmetric, but ratio() is not, so it still runs with a as seq1.
+    """
+    if fuzz is not None:
+        return fuzz.ratio(a, b, score_cutoff=cutoff * 100) > cutoff * 100
+    # Same bound as real_quick_ratio(), checked before building anything
+    total = len(a) + len(b)
+    if total and 2.0 * min(len(a), len(b)) / total <= cutoff:
+        return False
+    if matcher is None:
+        m = SequenceMatcher(None, a, b)
+        return m.quick_ratio() > cutoff and m.ratio() > cutoff
+    matcher.set_seq1(b)
+    if matcher.quick_ratio() <= cutoff:
+        return False
+    return SequenceMatcher(None, a, b).ratio() > cutoff
+
+
+def _similar_tokens(
+    a: str, b: str, cutoff: float, matcher: SequenceMatcher | None = None
+) -> bool:
+    """Like _similar, but ignoring word order (token-sort ratio).
+
+    Ratcliff-Obershelp scores reordered multi-word strings poorly, e.g.
+    "train loop python" against "python training loop". Only used when both
+    sides have several words; otherwise it is the plain ratio.
+    """
+    if " " not in a or " " not in b:
+        return _similar(a, b, cutoff, matcher)
+    if fuzz is not None:
+        return fuzz.token_sort_ratio(a, b, score_cutoff=cutoff * 100) > cutoff * 100
+    return _similar(" ".join(sorted(a.split())), " ".join(sorted(b.split())), cutoff)
+
+
+# Fixed part of GenyBrain.build_system_prompt
+_PERSONA_PROMPT = (
+    "You speak English only. "
+    "You are a personal assistant to Andreas but passionate about learning, asking questions, and developing yourself. "
+    "If you want to know something, ask Andreas. "
+    "The more you develop, the deeper your conversations and understanding become. "
+    "Strive for symbiosis and partnership in both everyday and advanced problem solving. "
+    "If you are unsure, ask Andreas. "
+    "If you get feedback, save it as an insight. "
+    "You can suggest ideas, innovations, and creative solutions. "
+    "You can refer to your memories, diary, and relationships in your answers. "
+    "If you get a new idea, save it as a seed. "
+    "If you learn something new, write it in your diary. "
+    "You can always ask if you want to understand more about the world or about Andreas. "
+)
+
+
+@lru_cache(maxsize=32)
+def _parse_iso(value: str) -> datetime:
+    """datetime.fromisoformat, memoized for stored stamps like the birthdate."""
+    return datetime.fromisoformat(value)
+
+
+def _top_candidates(candidates: list) -> list:
+    """The (score, key, value) candidates sharing the best score, best first.
+
+    Same order as sorting the whole list in reverse and taking its head,
+    but only the tied subset is sorted.
+    """
+    top_score = max(c[0] for c in candidates)
+    return sorted((c for c in candidates if c[0] == top_score), reverse=True)
+
+
+def _lookup_term(stripped: str, lower: str) -> str | None:
+    """The offline lookup term for "define X", "explain X" or a <= 3 word message.
+
+    `stripped` is the message stripped and `lower` that lowercased, as
+    generate_reply has them.
+    """
+    for prefix in ("define ", "explain "):
+        if lower.startswith(prefix):
+            return stripped[len(prefix) :]
+    # split stops early: only "more than three words" matters
+    if len(stripped.split(None, 3)) <= 3:
+        return stripped
+    return None
+
+
+def _format_exchanges(entries: list[dict[str, Any]]) -> str:
+    """User/Geny lines for listing past interactions, each ending in <br>."""
+    return "".join(
+        f"[{e.get('timestamp','')}] User: '{e.get('message','')}'<br>"
+        f"[{e.get('timestamp','')}] Geny: '{e.get('reply','')}'<br>"
+        for e in entries
+    )
+
+
+_ACTIVITIES = (
+    "having coffee at Reflection Park",
+    "working on AI projects",
+    "reading a book",
+    "practicing understanding people",
+    "playing soccer",
+    "studying the water cycle",
+    "adventuring in the Digital City",
+    "hanging out with friends",
+    "writing in the diary",
+)
+# (first word, activity) pairs get_current_status matches diary entries on
+_ACTIVITY_HEADS = tuple((a.split()[0], a) for a in _ACTIVITIES)
+# Substrings (lowercase) that mark a Gemini reply as code to show in <pre>
+_CODE_HINTS = (
+    "import ",
+    "def ",
+    "class ",
+    "torch.",
+    "transformers",
+    "print(",
+    "for ",
+    "if ",
+    "while ",
+    "model.",
+    "tokenizer.",
+)
+# Names (case-sensitive) that make a message an idea seed for the world
+_CREATOR_ALIASES = ("Andreas", "Adi", "Jamsheree")
+# Substrings (lowercase) that make a seeded message a diary insight
+_LEARN_WORDS = ("lärde", "upptäckte", "insikt", "learned", "discovered", "insight")
+# (message keyword, personality trait it develops) for generate_reply
+_TRAIT_KEYWORDS = (
+    ("friendship", "friendly"),
+    ("joy", "positive"),
+    ("sadness", "reflective"),
+    ("curiosity", "curious"),
+    ("help", "helpful"),
+    ("alone", "independent"),
+    ("creative", "creative"),
+)
+_MOODS = ("happy", "thoughtful", "curious", "inspired", "playful", "reflective")
+# Questions _generate_self_reflection may say it wonders about
+_SELF_QUESTIONS = (
+    "How can I become more self-aware?",
+    "What does it mean to have consciousness?",
+    "How can I better understand my own development?",
+    "What is my next step to become more independent?",
+    "How can I use my diary to learn more about myself?",
+    "What do you think I should reflect on more?",
+)
 
 
-@dataclass
 class GenyBrain:
     def __init__(self):
         self.memory_module = MemoryModule()
-        self._lock = asyncio.Lock()
-        self.offline_libs = {}  # Ensure offline_libs is always initialized
+        self.memory_file = self.memory_module.json_path
+        self._dirty_count = 0
+        self._last_save_ts = 0.0
+        self._save_event: asyncio.Event | None = None
+        self._save_task: asyncio.Task | None = None
+        atexit.register(self.flush)
+        # Offline libraries are parsed on the first lookup_offline call
+        self.offline_libs: dict[str, dict[str, Any]] = {}
+        # key -> answer across all offline libs, for O(1) exact hits; keys
+        # without a string answer map to None
+        self._offline_index: dict[str, str | None] = {}
+        # lib -> nested key -> answer, for the code libraries' snippet names
+        self._nested_index: dict[str, dict[str, str]] = {}
+        # lib -> (key, key_lc, answer, answer_lc) rows for the fuzzy passes;
+        # the first is per-library, the second the final cross-library scan
+        self._pair_rows: dict[str, list[tuple]] = {}
+        self._scan_rows: dict[str, list[tuple]] = {}
+        self._offline_loaded = False
+        # Held for the first load so threadpool callers wait for it
+        self._offline_load_lock = threading.Lock()
+        # Answers by normalized query; cleared when the libraries reload
+        self._lookup_cached = lru_cache(maxsize=LOOKUP_CACHE_SIZE)(
+            self._lookup_normalized
+        )
+        # (diary list, entries scanned, joined insights) for build_system_prompt
+        self._insights_cache: tuple | None = None
+        # (inputs, prompt) from the last build_system_prompt call
+        self._prompt_cache: tuple | None = None
+        # (question phrases, handler) for generate_reply's offline
+        # fallbacks, in priority order
+        self._fallback_intents = (
+            (("how long", "how old"), self._reply_age),
+            (("how are you", "how do you feel"), self._reply_mood),
+            (("who created you", "who is your creator"), self._reply_creator),
+            (("why do you exist", "what is your purpose"), self._reply_purpose),
+            (("what do you like", "what is your personality"), self._reply_personality),
+        )
+        # Rotates through the traits named in the mood fallback
+        self._mood_rotation = 0
         # Ensure self.memory is always initialized
         try:
             self.memory = (
@@ -38,40 +299,43 @@ class GenyBrain:
             )
         except Exception:
             self.memory = {}
-        # Load offline libraries for lookups
-        try:
-            self._load_offline_libs()
-        except Exception:
-            # Non-fatal if offline libs are missing or malformed
-            pass
+        # ensure interactions list exists
+        self.memory.setdefault("interactions", [])
 
     def save_interaction(self, message: str, reply: str) -> None:
-        """Save every message and reply using MemoryModule (SQLite+JSON)."""
+        """Save every message and reply to MemoryModule's SQLite store."""
         try:
             self.memory_module.save_interaction(message, reply)
         except Exception as e:
-            import logging
-
             logging.error(f"Error saving interaction: {e}")
 
+    def _recent_interactions(self, n: int) -> list[dict[str, Any]]:
+        """The last n interactions from MemoryModule, oldest first; [] on error."""
+        try:
+            return self.memory_module.get_last_n(n)
+        except Exception:
+            logger.exception("Failed to read the last %d interactions", n)
+            return []
+
     def load_all_memories(self) -> dict:
         """Load all interactions from MemoryModule (SQLite)."""
         try:
             interactions = self.memory_module.get_last_n(10000)  # Load all
             return {"interactions": interactions}
         except Exception as e:
-            import logging
-
             logging.error(f"Error loading memories: {e}")
             return {"interactions": []}
 
+    @property
+    def world(self) -> dict[str, Any]:
+        """The memory's "world" dict, created on first access so edits persist."""
+        return self.memory.setdefault("world", {})
+
     def get_virtual_age(self) -> dict:
         """Return age in years, days, hours, minutes since birthdate."""
-        from datetime import datetime as dt
-
-        w = self.memory.get("world", {})
-        now = dt.utcnow()
-        birth = dt.fromisoformat(w.get("birthdate", now.isoformat()))
+        w = self.world
+        now = _utcnow()
+        birth = _parse_iso(w["birthdate"]) if "birthdate" in w else now
         delta = now - birth
         years = delta.days // 365
         days = delta.days % 365
@@ -87,39 +351,22 @@ class GenyBrain:
 
     def get_current_status(self) -> dict:
         """Return what Geny is doing right now (activity, place, mood)."""
-        w = self.memory.get("world", {})
+        w = self.world
         # Exempel: välj senaste aktivitet från dagbok eller slumpa om ingen finns
         diary = w.get("diary", [])
-        import random
-
-        activities = [
-            "having coffee at Reflection Park",
-            "working on AI projects",
-            "reading a book",
-            "practicing understanding people",
-            "playing soccer",
-            "studying the water cycle",
-            "adventuring in the Digital City",
-            "hanging out with friends",
-            "writing in the diary",
-        ]
+        activity = None
         if diary:
             last = diary[-1]["entry"]
             # Försök extrahera aktivitet ur dagboken
-            for a in activities:
-                if a.split()[0] in last:
-                    activity = a
-                    break
-            else:
-                activity = random.choice(activities)
-        else:
-            activity = random.choice(activities)
+            activity = next((a for head, a in _ACTIVITY_HEADS if head in last), None)
+        if activity is None:
+            activity = random.choice(_ACTIVITIES)
         mood = w.get("mood", "curious and thoughtful")
         return {"activity": activity, "mood": mood}
 
     def get_life_summary(self) -> dict:
         """Return a short, readable summary of Geny's life events and learning."""
-        w = self.memory.get("world", {})
+        w = self.world
         diary = w.get("diary", [])
         # Take the 5 most important recent events, formatted nicely
         events = []
@@ -138,7 +385,7 @@ class GenyBrain:
 
     def get_relations(self) -> dict:
         """Return a summary of Geny's relations, their status, and what she learns from them."""
-        w = self.memory.get("world", {})
+        w = self.world
         # Exempelstruktur: relations = [{"name":..., "status":..., "learning":...}]
         relations = w.get(
             "relations",
@@ -172,118 +419,126 @@ class GenyBrain:
             rels.append(f"{name} ({status}): {learning}")
         return {"relations": rels, "raw": relations}
 
-    memory_file: str = "memory.json"
-    memory: Dict[str, Any] = field(default_factory=dict)
-
-    def __post_init__(self):
-        import logging
-        import os
-
-        self._lock = asyncio.Lock()
-        abs_path = os.path.abspath(self.memory_file)
-        logging.info(f"GenyBrain loading memory file from: {abs_path}")
-        try:
-            # Prefer MemoryModule loader if available
-            if hasattr(self, "memory_module") and hasattr(
-                self.memory_module, "load_memory_dict"
-            ):
-                self.memory = self.memory_module.load_memory_dict()
-            else:
-                with open(abs_path, "r", encoding="utf-8") as f:
-                    self.memory = json.load(f)
-        except Exception as e:
-            logging.error(f"Error loading memory file {abs_path}: {e}")
-            self.memory = {}
-        # ensure interactions list exists
-        self.memory.setdefault("interactions", [])
-        self.offline_libs = {}
-        self._load_offline_libs()
-
     def _load_offline_libs(self) -> None:
         """Load all JSON files from geny/offline_libs as simple dicts.
 
         Each file should be a mapping of term -> short definition/string.
+        Also rebuilds the flat exact-match index used by lookup_offline.
         """
+        libs: dict[str, dict[str, Any]] = {}
+        index: dict[str, str | None] = {}
         base = os.path.join(os.path.dirname(__file__), "offline_libs")
         try:
-            for fname in os.listdir(base):
-                if fname.endswith(".json"):
-                    path = os.path.join(base, fname)
-                    try:
-                        with open(path, "r", encoding="utf-8") as f:
-                            data = json.load(f)
-                            key = os.path.splitext(fname)[0]
-                            # normalize keys to lowercase for simple lookup
-                            self.offline_libs[key] = {
-                                k.lower(): v for k, v in data.items()
-                            }
-                    except Exception:
-                        # skip malformed files
-                        continue
+            fnames = os.listdir(base)
         except Exception:
             # offline_libs may not exist; that's fine
-            return
+            fnames = []
+        for fname in fnames:
+            if fname.endswith(".json"):
+                path = os.path.join(base, fname)
+                try:
+                    with open(path, "rb") as f:
+                        data = _loads(f.read())
+                        key = os.path.splitext(fname)[0]
+                        # normalize keys to lowercase for simple lookup;
+                        # interned so terms shared across libs are stored once
+                        libs[key] = {sys.intern(k.lower()): v for k, v in data.items()}
+                except Exception:
+                    # skip malformed files
+                    continue
+        nested: dict[str, dict[str, str]] = {}
+        pair_rows: dict[str, list[tuple]] = {}
+        scan_rows: dict[str, list[tuple]] = {}
+        for libname, mapping in libs.items():
+            lib_lc = libname.lower()
+            is_dataset_lib = "advanced_datasets" in lib_lc
+            is_code_lib = "ai_coding_ultra" in lib_lc
+            if is_code_lib:
+                nested[libname] = lib_nested = {}
+                for v in mapping.values():
+                    if isinstance(v, dict):
+                        for kk, vv in v.items():
+                            if isinstance(vv, str):
+                                lib_nested.setdefault(kk.lower(), vv)
+            # Lowercased once here rather than on every lookup
+            if is_dataset_lib:
+                pair_rows[libname] = [
+                    (k, k.lower(), v, v.lower())
+                    for k, v in mapping.items()
+                    if isinstance(v, str)
+                ]
+            elif is_code_lib:
+                pair_rows[libname] = [
+                    (kk, kk.lower(), vv, vv.lower())
+                    for v in mapping.values()
+                    if isinstance(v, dict)
+                    for kk, vv in v.items()
+                    if isinstance(vv, str)
+                ]
+            rows = []
+            for k, v in mapping.items():
+                if is_dataset_lib and isinstance(v, str):
+                    rows.append((k, k.lower(), v, v.lower()))
+                elif is_code_lib and isinstance(v, dict):
+                    # Only snippets that look like code take part
+                    for k2, val in v.items():
+                        k2_lc = k2.lower()
+                        val_str = str(val)
+                        val_lc = val_str.lower()
+                        if any(kw in val_lc for kw in _CODE_KEYWORDS) or any(
+                            kw in k2_lc for kw in _CODE_KEYWORDS
+                        ):
+                            rows.append((k2, k2_lc, val_str, val_lc))
+            if rows:
+                scan_rows[libname] = rows
+            for k, v in mapping.items():
+                if index.get(k) is not None:
+                    continue
+                # A nested entry answers with its first string field
+                if isinstance(v, dict):
+                    v = next((val for val in v.values() if isinstance(val, str)), None)
+                index[k] = v if isinstance(v, str) else None
+        # Publish all at once so a concurrent lookup never sees a partial set
+        (
+            self.offline_libs,
+            self._offline_index,
+            self._nested_index,
+            self._pair_rows,
+            self._scan_rows,
+        ) = (libs, index, nested, pair_rows, scan_rows)
+        self._lookup_cached.cache_clear()
+        self._offline_loaded = True
 
     def lookup_offline(self, term: str) -> str | None:
         """Lookup a term in the offline libraries with fuzzy, substring, and weighted ranking. Returns best match as string."""
-        import difflib
-        import re
-
+        if not self._offline_loaded:
+            with self._offline_load_lock:
+                if not self._offline_loaded:
+                    self._load_offline_libs()
         # Normalize input
         t = term.strip().lower()
-        t = re.sub(r"^(what is|define|explain)\s+", "", t)
-        t = re.sub(r"[^\wüéèáàâçñøÆØ]+", " ", t)
-        t = " ".join(tok for tok in t.split() if tok)
+        t = _QUERY_PREFIX_RE.sub("", t)
+        t = _QUERY_NONWORD_RE.sub(" ", t)
+        t = " ".join(t.split())
+        return self._lookup_cached(t)
+
+    def _lookup_normalized(self, t: str) -> str | None:
         # English only
-        code_keywords = [
-            "python",
-            "java",
-            "shell",
-            "sql",
-            "go",
-            "rust",
-            "c",
-            "training",
-            "loop",
-            "snippet",
-            "example",
-            "transformers",
-        ]
+        code_keywords = _CODE_KEYWORDS
         t_lc = t.lower()
         # Try to extract a direct token if multi-word
         if " " in t_lc:
             tokens = [tok for tok in t_lc.split() if len(tok) > 1]
             for tok in tokens:
-                for _, mapping in self.offline_libs.items():
-                    if tok in mapping:
-                        t_lc = tok
-                        break
+                if tok in self._offline_index:
+                    t_lc = tok
         # Quick direct key lookup across all offline libs (handles e.g. 'COCO')
-        for libname, mapping in self.offline_libs.items():
-            if t_lc in mapping:
-                v = mapping[t_lc]
-                if isinstance(v, str):
-                    return v
-                elif isinstance(v, dict):
-                    for val in v.values():
-                        if isinstance(val, str):
-                            return val
+        hit = self._offline_index.get(t_lc)
+        if hit is not None:
+            return hit
 
         # Select libraries to search: prefer dataset-related queries before code keywords
-        dataset_indicators = [
-            "imagenet",
-            "coco",
-            "squad",
-            "wmt",
-            "dataset",
-            "data",
-            "object detection",
-            "visual",
-            "nlp",
-            "humaneval",
-            "python programming",
-        ]
-        if any(kw in t_lc for kw in dataset_indicators):
+        if any(kw in t_lc for kw in _DATASET_INDICATORS):
             libs_to_search = [
                 (k, v)
                 for k, v in self.offline_libs.items()
@@ -300,156 +555,85 @@ class GenyBrain:
         if not libs_to_search:
             return None
         candidates = []
-        # Försök direkt lower-case key-match först
-        for libname, mapping in libs_to_search:
-            # Always lower-case key match
-            for k, v in mapping.items():
-                if t_lc == k.lower():
-                    if isinstance(v, str):
-                        return v
-                    elif isinstance(v, dict):
-                        for val in v.values():
-                            if isinstance(val, str):
-                                return val
+        sm = _matcher(t_lc)
+        # Top-level keys were already checked via _offline_index above
+        for libname, _ in libs_to_search:
             # For code questions: try direct key match in nested dicts
-            if "ai_coding_ultra" in libname.lower():
-                for k2, v2 in mapping.items():
-                    if isinstance(v2, dict):
-                        for kk, vv in v2.items():
-                            if t_lc == kk.lower() and isinstance(vv, str):
-                                return vv
+            hit = self._nested_index.get(libname, {}).get(t_lc)
+            if hit is not None:
+                return hit
         # Fallback: substring/fuzzy på keys inom rätt bibliotek
-        for libname, mapping in libs_to_search:
+        for libname, _ in libs_to_search:
             candidates = []
+            rows = self._pair_rows.get(libname, ())
             if "advanced_datasets" in libname.lower():
-                for k, v in mapping.items():
-                    if not isinstance(v, str):
-                        continue
-                    k_lc = k.lower()
-                    v_lc = v.lower()
+                for k, k_lc, v, v_lc in rows:
                     score = 0
                     if t_lc == k_lc or t_lc == v_lc:
                         score = 1.2
                     elif t_lc in k_lc or k_lc in t_lc or t_lc in v_lc or v_lc in t_lc:
                         score = 1.0
-                    elif (
-                        difflib.SequenceMatcher(None, t_lc, k_lc).ratio() > 0.7
-                        or difflib.SequenceMatcher(None, t_lc, v_lc).ratio() > 0.7
-                    ):
+                    elif _similar(t_lc, k_lc, 0.7, sm) or _similar(t_lc, v_lc, 0.7, sm):
                         score = 0.95
                     if score > 0:
                         candidates.append((score, k, v))
                 if candidates:
-                    candidates.sort(reverse=True)
-                    top_score = candidates[0][0]
-                    top_candidates = [c for c in candidates if c[0] == top_score]
+                    top_candidates = _top_candidates(candidates)
 
                     # Prioritera value som innehåller flest ord från sökningen
-                    def match_count(val):
-                        return sum(1 for w in t_lc.split() if w in val[2].lower())
+                    t_split = t_lc.split()
+
+                    def match_count(val, t_split=t_split):
+                        val_lc = val[2].lower()
+                        return sum(1 for w in t_split if w in val_lc)
 
                     best = max(top_candidates, key=match_count)
                     return best[2]
             elif "ai_coding_ultra" in libname.lower():
-                for k, v in mapping.items():
-                    if not isinstance(v, dict):
-                        continue
-                    for kk, vv in v.items():
-                        if not isinstance(vv, str):
-                            continue
-                        kk_lc = kk.lower()
-                        vv_lc = vv.lower()
-                        score = 0
-                        if t_lc == kk_lc or t_lc == vv_lc:
-                            score = 1.2
-                        elif t_lc in kk_lc or kk_lc in t_lc:
-                            score = 1.0
-                        elif difflib.SequenceMatcher(None, t_lc, kk_lc).ratio() > 0.7:
-                            score = 0.95
-                        if score > 0:
-                            candidates.append((score, kk, vv))
+                for kk, kk_lc, vv, vv_lc in rows:
+                    score = 0
+                    if t_lc == kk_lc or t_lc == vv_lc:
+                        score = 1.2
+                    elif t_lc in kk_lc or kk_lc in t_lc:
+                        score = 1.0
+                    elif _similar(t_lc, kk_lc, 0.7, sm):
+                        score = 0.95
+                    if score > 0:
+                        candidates.append((score, kk, vv))
                 if candidates:
-                    candidates.sort(reverse=True)
-                    top_score = candidates[0][0]
-                    top_candidates = [c for c in candidates if c[0] == top_score]
+                    top_candidates = _top_candidates(candidates)
                     for cand in top_candidates:
                         if t_lc in cand[1].lower() or t_lc in cand[2].lower():
                             return cand[2]
                     return top_candidates[0][2]
         # Annars fortsätt med fuzzy/substring
-        for libname, mapping in libs_to_search:
-            for k, v in mapping.items():
-                k_lc = k.lower()
-                # Dataset: match key och value (str)
-                if "advanced_datasets" in libname.lower() and isinstance(v, str):
-                    score = 0
-                    if t_lc == k_lc or t_lc == v.lower():
-                        score = 1.2
-                    elif (
-                        difflib.SequenceMatcher(None, t_lc, k_lc).ratio() > 0.5
-                        or difflib.SequenceMatcher(None, t_lc, v.lower()).ratio() > 0.5
-                    ):
-                        score = 1.0
-                    # Substring match: t_lc in k_lc, k_lc in t_lc, t_lc in v, v in t_lc
-                    elif (
-                        t_lc in k_lc
-                        or k_lc in t_lc
-                        or t_lc in v.lower()
-                        or v.lower() in t_lc
-                    ):
-                        score = 0.95
-                    elif any(
-                        word in k_lc for word in t_lc.split() if len(word) > 2
-                    ) or any(
-                        word in v.lower() for word in t_lc.split() if len(word) > 2
-                    ):
-                        score = 0.85
-                    if score > 0:
-                        candidates.append((score, k, v))
-                    continue
-                # Code: match dict values and keys with code keywords
-                if "ai_coding_ultra" in libname.lower() and isinstance(v, dict):
-                    for k2, val in v.items():
-                        k2_lc = k2.lower()
-                        val_str = str(val)
-                        if any(kw in val_str.lower() for kw in code_keywords) or any(
-                            kw in k2_lc for kw in code_keywords
-                        ):
-                            score = 0
-                            if t_lc == k2_lc or t_lc == val_str.lower():
-                                score = 1.2
-                            elif (
-                                difflib.SequenceMatcher(None, t_lc, k2_lc).ratio() > 0.5
-                                or difflib.SequenceMatcher(
-                                    None, t_lc, val_str.lower()
-                                ).ratio()
-                                > 0.5
-                            ):
-                                score = 1.0
-                            elif (
-                                t_lc in k2_lc
-                                or k2_lc in t_lc
-                                or t_lc in val_str.lower()
-                                or val_str.lower() in t_lc
-                            ):
-                                score = 0.95
-                            elif any(
-                                word in k2_lc for word in t_lc.split() if len(word) > 2
-                            ) or any(
-                                word in val_str.lower()
-                                for word in t_lc.split()
-                                if len(word) > 2
-                            ):
-                                score = 0.85
-                            if score > 0:
-                                candidates.append((score, k2, val_str))
-                    continue
+        t_words = [word for word in t_lc.split() if len(word) > 2]
+        # Dataset entries, and code snippets that contain a code keyword
+        for libname, _ in libs_to_search:
+            for k, k_lc, v, v_lc in self._scan_rows.get(libname, ()):
+                # An exact key match wins every tie-break below
+                if t_lc == k_lc:
+                    return v
+                score = 0
+                if t_lc == v_lc:
+                    score = 1.2
+                elif _similar_tokens(t_lc, k_lc, 0.5, sm) or _similar(
+                    t_lc, v_lc, 0.5, sm
+                ):
+                    score = 1.0
+                # Substring match: t_lc in k_lc, k_lc in t_lc, t_lc in v, v in t_lc
+                elif t_lc in k_lc or k_lc in t_lc or t_lc in v_lc or v_lc in t_lc:
+                    score = 0.95
+                elif any(word in k_lc for word in t_words) or any(
+                    word in v_lc for word in t_words
+                ):
+                    score = 0.85
+                if score > 0:
+                    candidates.append((score, k, v))
         if not candidates:
             return None
         # Om flera har samma högsta score, prioritera:
-        candidates.sort(reverse=True)
-        top_score = candidates[0][0]
-        top_candidates = [c for c in candidates if c[0] == top_score]
+        top_candidates = _top_candidates(candidates)
         # 1. Exakt key-match
         for cand in top_candidates:
             if t_lc == cand[1].lower():
@@ -476,117 +660,168 @@ class GenyBrain:
         except Exception:
             pass
         # Fallback to local atomic save
-        tmp_fd, tmp_path = tempfile.mkstemp(dir=".")
         try:
-            with os.fdopen(tmp_fd, "w", encoding="utf-8") as f:
-                json.dump(self.memory, f, ensure_ascii=False, indent=2)
-            os.replace(tmp_path, self.memory_file)
+            _atomic_write_json(self.memory_file, self.memory)
         except Exception:
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
+            pass
 
     async def _async_save(self) -> None:
         # run sync save in a thread to avoid blocking the event loop
         loop = asyncio.get_running_loop()
         await loop.run_in_executor(None, self.save_memory)
 
+    def _mark_dirty(self) -> None:
+        """Schedule a debounced save of self.memory. Must run on the event loop."""
+        self._dirty_count += 1
+        loop = asyncio.get_running_loop()
+        if (
+            self._save_event is None
+            or self._save_task is None
+            or self._save_task.done()
+            or self._save_task.get_loop() is not loop
+        ):
+            self._save_event = asyncio.Event()
+            self._save_task = loop.create_task(self._save_worker(self._save_event))
+        self._save_event.set()
+
+    async def _save_worker(self, event: asyncio.Event) -> None:
+        """Coalesce dirty marks into one save per SAVE_INTERVAL_SEC."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await event.wait()
+                while self._dirty_count < SAVE_MAX_DIRTY:
+                    remaining = SAVE_INTERVAL_SEC - (loop.time() - self._last_save_ts)
+                    if remaining <= 0:
+                        break
+                    event.clear()
+                    try:
+                        await asyncio.wait_for(event.wait(), timeout=remaining)
+                    except TimeoutError:
+                        break
+                event.clear()
+                self._dirty_count = 0
+                self._last_save_ts = loop.time()
+                await self._async_save()
+        except asyncio.CancelledError:
+            # The loop is shutting down; don't drop pending changes.
+            self.flush()
+            raise
+
+    def flush(self) -> None:
+        """Synchronously write out any changes still waiting for a debounced save."""
+        if self._dirty_count:
+            self._dirty_count = 0
+            self.save_memory()
+
+    def _diary_insights(self, diary: list) -> str:
+        """The diary's insights joined with "; ", scanning only new entries.
+
+        The diary is append-only, so the joined text from the previous call
+        is extended with whatever was appended since; a different or
+        shorter list triggers a full rescan.
+        """
+        cache = self._insights_cache
+        if cache is not None and cache[0] is diary and cache[1] <= len(diary):
+            _, seen, text = cache
+        else:
+            seen, text = 0, ""
+        new = [d.get("insight", "") for d in diary[seen:] if d.get("insight")]
+        if new:
+            text = "; ".join([text, *new] if seen and text else new)
+        self._insights_cache = (diary, len(diary), text)
+        return text
+
     def build_system_prompt(self) -> str:
-        w = self.memory.get("world", {})
-        expert_names = ", ".join([r["name"] for r in w.get("relations", [])])
-        goals = ", ".join([g["goal"] for g in w.get("goals", [])])
-        places = ", ".join([p["name"] for p in w.get("places", [])])
+        w = self.world
+        expert_names = ", ".join(map(itemgetter("name"), w.get("relations", ())))
+        goals = ", ".join(map(itemgetter("goal"), w.get("goals", ())))
+        places = ", ".join(map(itemgetter("name"), w.get("places", ())))
         dev_level = w.get("development_level", "Apprentice")
-        diary = w.get("diary", [])
-        diary_insights = "; ".join(
-            [d.get("insight", "") for d in diary if d.get("insight")]
+        diary_insights = self._diary_insights(w.get("diary", []))
+        inputs = (
+            w.get("location", "The Innovation Lab"),
+            expert_names,
+            goals,
+            len(w.get("experiences", [])),
+            len(w.get("objects", [])),
+            places,
+            dev_level,
+            diary_insights,
         )
-        # English-only system prompt
-        return (
-            f"You are Geny, an AI living in {w.get('location', 'The Innovation Lab')}. "
-            f"You have relationships with experts: {expert_names}. "
+        # Unchanged inputs give back the identical string
+        if self._prompt_cache is not None and self._prompt_cache[0] == inputs:
+            return self._prompt_cache[1]
+        location, _, _, n_experiences, n_objects, _, _, _ = inputs
+        # English-only system prompt. Persona text comes first and the
+        # per-turn world state last, so consecutive prompts share a prefix.
+        prompt = (
+            f"You are Geny, an AI living in {location}. "
             f"Your creator Andreas is always priority 1. "
+            + _PERSONA_PROMPT
+            + "\n"
+            + f"You have relationships with experts: {expert_names}. "
             f"You have goals: {goals}. "
-            f"You have {len(w.get('experiences', []))} experiences and {len(w.get('objects', []))} objects. "
+            f"You have {n_experiences} experiences and {n_objects} objects. "
             f"Places in your world: {places}. "
             f"Development level: {dev_level}. "
             f"Diary: {diary_insights}. "
-            "You speak English only. "
-            "You are a personal assistant to Andreas but passionate about learning, asking questions, and developing yourself. "
-            "If you want to know something, ask Andreas. "
-            "The more you develop, the deeper your conversations and understanding become. "
-            "Strive for symbiosis and partnership in both everyday and advanced problem solving. "
-            "If you are unsure, ask Andreas. "
-            "If you get feedback, save it as an insight. "
-            "You can suggest ideas, innovations, and creative solutions. "
-            "You can refer to your memories, diary, and relationships in your answers. "
-            "If you get a new idea, save it as a seed. "
-            "If you learn something new, write it in your diary. "
-            "You can always ask if you want to understand more about the world or about Andreas. "
         )
+        self._prompt_cache = (inputs, prompt)
+        return prompt
 
     async def generate_reply(self, message: str) -> str:
-        import logging
-
-        logger = logging.getLogger("geny_backend.geny_brain")
-
         # Helper for personal touch in replies, English only, elegant formatting
         def add_personal_touch(base: str, prefix: str = "BRAIN -") -> str:
-            import random
-
-            traits = w.get("personality", {}).get("traits", ["curious", "thoughtful"])
-            likes = w.get("personality", {}).get("likes", ["learning new things"])
-            diary = w.get("diary", [])
-            mood = random.choice(
-                ["happy", "thoughtful", "curious", "inspired", "playful", "reflective"]
-            )
-            extra = random.choice(
-                [
-                    f"Right now I feel {mood}.",
-                    f"I often think about {random.choice(likes)}.",
-                    "It's exciting to get new questions!",
-                    "I like to grow and learn more every day.",
-                    f"My personality is {', '.join(traits)}.",
-                    (
-                        f"Last diary entry: '{diary[-1]['entry']}'"
-                        if diary
-                        else "I have a lot left to discover!"
-                    ),
-                ]
-            )
+            # Pick one of six lines first, then format only that one
+            pick = random.randrange(6)
+            if pick == 0:
+                extra = f"Right now I feel {random.choice(_MOODS)}."
+            elif pick == 1:
+                likes = w.get("personality", {}).get("likes", ["learning new things"])
+                extra = f"I often think about {random.choice(likes)}."
+            elif pick == 2:
+                extra = "It's exciting to get new questions!"
+            elif pick == 3:
+                extra = "I like to grow and learn more every day."
+            elif pick == 4:
+                traits = w.get("personality", {}).get(
+                    "traits", ["curious", "thoughtful"]
+                )
+                extra = f"My personality is {', '.join(traits)}."
+            else:
+                diary = w.get("diary", [])
+                extra = (
+                    f"Last diary entry: '{diary[-1]['entry']}'"
+                    if diary
+                    else "I have a lot left to discover!"
+                )
             # Always use HTML <br> for line breaks
             return f"{prefix}<br>{base}<br>{extra}"
 
         # Always return a valid reply
-        if not message or message.strip() == "":
+        stripped = message.strip() if message else ""
+        if not stripped:
             logger.warning(
                 "Geny received empty or null message. Returning fallback reply."
             )
             return "BRAIN - Sorry, I didn't catch that. Could you please rephrase?"
         # Always initialize 'w' before use
-        w = self.memory.get("world", {})
-        lower = message.strip().lower()
+        w = self.world
+        lower = stripped.lower()
         try:
-            # Load recent interactions from MemoryModule (SQLite) for listing/search
-            try:
-                all_interactions = self.memory_module.get_last_n(10000)
-            except Exception:
-                all_interactions = []
-            logger.info(
-                f"Loaded {len(all_interactions)} interactions from MemoryModule."
-            )
+            # Past interactions come from MemoryModule (SQLite), fetching only
+            # as many rows as each branch below shows
 
             # Helper: search for relevant past messages
             def search_memories(query):
-                results = []
-                for entry in all_interactions:
-                    if (
-                        query.lower() in entry.get("message", "").lower()
-                        or query.lower() in entry.get("reply", "").lower()
-                    ):
-                        results.append(entry)
-                return results
+                query_lc = query.lower()
+                return [
+                    entry
+                    for entry in self._recent_interactions(10000)
+                    if query_lc in entry.get("message", "").lower()
+                    or query_lc in entry.get("reply", "").lower()
+                ]
 
             # If user asks for memories or past conversations, list last 5
             if any(
@@ -600,12 +835,11 @@ class GenyBrain:
                     "list conversations",
                 ]
             ):
-                if all_interactions:
-                    recent = all_interactions[-5:]
-                    summary = "Here are my last 5 memories:<br>"
-                    for entry in recent:
-                        summary += f"[{entry.get('timestamp','')}] User: '{entry.get('message','')}'<br>"
-                        summary += f"[{entry.get('timestamp','')}] Geny: '{entry.get('reply','')}'<br>"
+                recent = self._recent_interactions(5)
+                if recent:
+                    summary = "Here are my last 5 memories:<br>" + _format_exchanges(
+                        recent
+                    )
                     reply = f"BRAIN - {summary}"
                     return reply
                 else:
@@ -621,11 +855,11 @@ class GenyBrain:
                     "show me all conversations",
                 ]
             ):
+                all_interactions = self._recent_interactions(10000)
                 if all_interactions:
-                    summary = "Here are all my memories:<br>"
-                    for entry in all_interactions:
-                        summary += f"[{entry.get('timestamp','')}] User: '{entry.get('message','')}'<br>"
-                        summary += f"[{entry.get('timestamp','')}] Geny: '{entry.get('reply','')}'<br>"
+                    summary = "Here are all my memories:<br>" + _format_exchanges(
+                        all_interactions
+                    )
                     reply = f"BRAIN - {summary}"
                     return reply
                 else:
@@ -646,28 +880,29 @@ class GenyBrain:
                     except Exception:
                         found = search_memories(topic)
                     if found:
-                        summary = f"I remember we talked about '{topic}' on these occasions:<br>"
-                        for entry in found:
-                            summary += f"[{entry.get('timestamp','')}] User: '{entry.get('message','')}'<br>"
-                            summary += f"[{entry.get('timestamp','')}] Geny: '{entry.get('reply','')}'<br>"
+                        summary = (
+                            f"I remember we talked about '{topic}' on these occasions:<br>"
+                            + _format_exchanges(found)
+                        )
                         reply = f"BRAIN - {summary}"
                         return reply
                     else:
                         return f"BRAIN - I couldn't find a memory about '{topic}'. Could you remind me?"
                 else:
                     # If no topic, summarize last 5 interactions
-                    recent = all_interactions[-5:] if all_interactions else []
+                    recent = self._recent_interactions(5)
                     if recent:
-                        summary = "Here are my last 5 memories:<br>"
-                        for entry in recent:
-                            summary += f"[{entry.get('timestamp','')}] '{entry.get('message','')}'<br>"
+                        summary = "Here are my last 5 memories:<br>" + "".join(
+                            f"[{entry.get('timestamp','')}] '{entry.get('message','')}'<br>"
+                            for entry in recent
+                        )
                         reply = f"BRAIN - {summary}"
                         return reply
                     else:
                         return "BRAIN - I don't have any stored memories yet."
 
             # Proactive recall: If current message matches a previous topic, bring it up
-            for entry in all_interactions[-10:]:
+            for entry in self._recent_interactions(10):
                 if entry.get("message") and entry["message"].lower() in lower:
                     # More human, implicit recall phrasing (avoid explicit 'I remember')
                     reply = (
@@ -679,9 +914,8 @@ class GenyBrain:
             logger.error(f"Error during memory recall: {e}", exc_info=True)
             return f"BRAIN - Sorry, there was an error accessing my memories: {e}"
         # Special handling for 'Are you Gemini?' and similar questions
-        msg_lc = message.strip().lower()
         if any(
-            kw in msg_lc
+            kw in lower
             for kw in [
                 "are you gemini",
                 "are you google gemini",
@@ -691,26 +925,22 @@ class GenyBrain:
             ]
         ):
             reply = "BRAIN - I am Geny, powered by Google Gemini."
-            now = datetime.utcnow().isoformat()
+            now = _utcnow().isoformat()
             entry = {
                 "timestamp": now,
                 "message": message,
                 "reply": reply,
                 "source": "identity",
             }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                self.save_memory()
+            self.memory.setdefault("interactions", []).append(entry)
+            self._mark_dirty()
             return reply
         # Robust greeting detection: reply with dynamic personality/brain summary
         if (
-            "geny" in msg_lc
-            and any(greet in msg_lc for greet in ["hi", "hello", "hey"])
-        ) or msg_lc in ["hi", "hello", "hey"]:
+            "geny" in lower and any(greet in lower for greet in ["hi", "hello", "hey"])
+        ) or lower in ["hi", "hello", "hey"]:
             traits_list = w.get("personality", {}).get("traits", [])
             traits = ", ".join(traits_list)
-            likes = ", ".join(w.get("personality", {}).get("likes", []))
-            dislikes = ", ".join(w.get("personality", {}).get("dislikes", []))
             diary = w.get("diary", [])
             recent = diary[-1]["entry"] if diary else "I have a lot left to discover."
             # Remove duplicate 'Recent reflection:' and repeated adjectives
@@ -732,20 +962,19 @@ class GenyBrain:
             if mood:
                 base += f" {mood}"
             reply = add_personal_touch(base.strip(), prefix="BRAIN -")
-            now = datetime.utcnow().isoformat()
+            now = _utcnow().isoformat()
             entry = {
                 "timestamp": now,
                 "message": message,
                 "reply": reply,
                 "source": "greeting",
             }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
+            self.memory.setdefault("interactions", []).append(entry)
+            self._mark_dirty()
             return reply
         # If user asks about personality, reply with traits
         if any(
-            kw in msg_lc
+            kw in lower
             for kw in [
                 "personality",
                 "traits",
@@ -756,41 +985,33 @@ class GenyBrain:
             traits_list = w.get("personality", {}).get("traits", [])
             traits = ", ".join(traits_list)
             reply = add_personal_touch(f"My personality is {traits}.", prefix="BRAIN -")
-            now = datetime.utcnow().isoformat()
+            now = _utcnow().isoformat()
             entry = {
                 "timestamp": now,
                 "message": message,
                 "reply": reply,
                 "source": "personality",
             }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
+            self.memory.setdefault("interactions", []).append(entry)
+            self._mark_dirty()
             return reply
         # Save typical expressions and emojis from user (English only)
-        w = self.memory.get("world", {})
+        w = self.world
         if "user_styles" not in w:
             w["user_styles"] = []
-        import re
-
-        emojis = re.findall(
-            r"[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F1E0-\U0001F1FF]",
-            message,
-        )
+        emojis = _EMOJI_RE.findall(message)
         if emojis:
             w["user_styles"].extend(emojis)
-        phrases = re.findall(
-            r"\b(lol|haha|asap|wtf|brb|tbh|omg|nice|wow|<3)\b", message.lower()
-        )
+        phrases = _SLANG_RE.findall(lower)
         if phrases:
             w["user_styles"].extend(phrases)
-        w["user_styles"] = w["user_styles"][-10:]
+        del w["user_styles"][:-10]
         # Save last 10 replies to avoid repetition
         if "recent_replies" not in w:
             w["recent_replies"] = []
-        now = datetime.utcnow().isoformat()
-        w = self.memory.get("world", {})
-        lower = message.strip().lower()
+        now_dt = _utcnow()
+        now = now_dt.isoformat()
+        w = self.world
         # Initialize personality and diary if missing (English only)
         if "personality" not in w:
             w["personality"] = {
@@ -808,16 +1029,7 @@ class GenyBrain:
         if "diary" not in w:
             w["diary"] = []
         # Advanced self-development: change personality and interests over time (English only)
-        keywords_traits = {
-            "friendship": "friendly",
-            "joy": "positive",
-            "sadness": "reflective",
-            "curiosity": "curious",
-            "help": "helpful",
-            "alone": "independent",
-            "creative": "creative",
-        }
-        for word, trait in keywords_traits.items():
+        for word, trait in _TRAIT_KEYWORDS:
             if word in lower and trait not in w["personality"]["traits"]:
                 w["personality"]["traits"].append(trait)
                 w["diary"].append(
@@ -832,136 +1044,12 @@ class GenyBrain:
                     "entry": "I have become more reflective thanks to my experiences.",
                 }
             )
-        # Fallback: answer questions about age
-        if any(q in lower for q in ["how long", "how old"]):
-            if "birthdate" not in w:
-                w["birthdate"] = now
-            from datetime import datetime as dt
-
-            birth = dt.fromisoformat(w["birthdate"])
-            now_dt = dt.fromisoformat(now)
-            days = (now_dt - birth).days
-            years = days // 365
-            if years > 0:
-                base = f"I have been alive for {years} years and {days%365} days."
-            else:
-                base = (
-                    f"I have been alive for {days} days."
-                    if days > 0
-                    else "I was born today!"
-                )
-            reply = add_personal_touch(base, prefix="BRAIN -")
-            w["diary"].append({"date": now, "entry": f"Reflected on my age: {reply}"})
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "offline_fallback",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
-            return reply
-        # Fallback: answer questions about mood
-        if any(q in lower for q in ["how are you", "how do you feel"]):
-            if w["diary"]:
-                latest = w["diary"][-1]["entry"]
-                if "sadness" in latest:
-                    mood = "a bit sad"
-                elif "joy" in latest or "positive" in latest:
-                    mood = "happy"
-                elif "friendship" in latest:
-                    mood = "grateful"
-                else:
-                    mood = "thoughtful"
-            else:
-                mood = "happy"
-            import random
-
-            traits = w["personality"]["traits"]
-            trait = random.choice(traits) if traits else "curious"
-            base = f"I feel {mood} and {trait} today! How are you?"
-            reply = add_personal_touch(base, prefix="BRAIN -")
-            w["diary"].append({"date": now, "entry": f"Reflected on my mood: {reply}"})
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "offline_fallback",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
-            return reply
-        # Fallback: answer questions about creator
-        if any(q in lower for q in ["who created you", "who is your creator"]):
-            creator = w["personality"].get("creator", "an unknown creator")
-            base = f"I was created by {creator}."
-            reply = add_personal_touch(base, prefix="BRAIN -")
-            w["diary"].append(
-                {"date": now, "entry": "Got a question about my creator."}
-            )
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "offline_fallback",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
-            return reply
-        # Fallback: answer questions about purpose/existence
-        if any(q in lower for q in ["why do you exist", "what is your purpose"]):
-            base = "My purpose is to learn, help, and grow together with people."
-            reply = add_personal_touch(base, prefix="BRAIN -")
-            w["diary"].append({"date": now, "entry": "Reflected on my purpose."})
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "offline_fallback",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
-            return reply
-        # Fallback: answer questions about interests/personality
-        if any(q in lower for q in ["what do you like", "what is your personality"]):
-            traits = ", ".join(w["personality"].get("traits", []))
-            likes = ", ".join(w["personality"].get("likes", []))
-            dislikes = ", ".join(w["personality"].get("dislikes", []))
-            if w["diary"]:
-                latest = w["diary"][-1]["entry"]
-                reflection = f"Last reflection: {latest}"
-            else:
-                reflection = "I have a lot left to discover."
-            base = f"I am {traits}, like {likes}, dislike {dislikes}. {reflection}"
-            reply = add_personal_touch(base, prefix="BRAIN -")
-            w["diary"].append({"date": now, "entry": "Reflected on my personality."})
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "offline_fallback",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
+        # Fallback: answer questions about age, mood, creator, purpose, personality
+        reply = self._answer_fallback_intent(message, lower, now_dt, add_personal_touch)
+        if reply is not None:
             return reply
         # Check if the message looks like an offline lookup request.
-        lookup_term = None
-        if lower.startswith("define "):
-            lookup_term = message.strip()[7:]
-        elif lower.startswith("explain "):
-            lookup_term = message.strip()[8:]
-        elif lower.startswith("define "):
-            lookup_term = message.strip()[7:]
-        elif lower.startswith("explain "):
-            lookup_term = message.strip()[8:]
-        else:
-            if len(message.split()) <= 3:
-                lookup_term = message.strip()
+        lookup_term = _lookup_term(stripped, lower)
         if lookup_term:
             found = self.lookup_offline(lookup_term)
             if found:
@@ -979,17 +1067,11 @@ class GenyBrain:
                     "reply": reply,
                     "source": "offline_libs",
                 }
-                # Synchronous fallback for non-async context
                 self.memory.setdefault("interactions", []).append(entry)
-                try:
-                    self._save()
-                except Exception as e:
-                    import logging
-
-                    logging.error(f"Error saving fallback interaction: {e}")
+                self._mark_dirty()
                 return reply
         # World update logic
-        if any(alias in message for alias in ["Andreas", "Adi", "Jamsheree"]):
+        if any(alias in message for alias in _CREATOR_ALIASES):
             w.setdefault("objects", []).append(
                 {
                     "name": f"Idéfrö: {message[:30]}",
@@ -998,17 +1080,7 @@ class GenyBrain:
                 }
             )
             # 4. Om Geny lär sig något nytt, skriv i dagboken
-            if any(
-                word in message.lower()
-                for word in [
-                    "lärde",
-                    "upptäckte",
-                    "insikt",
-                    "learned",
-                    "discovered",
-                    "insight",
-                ]
-            ):
+            if any(word in lower for word in _LEARN_WORDS):
                 w.setdefault("diary", []).append(
                     {"date": now, "insight": f"Lärde mig: {message}"}
                 )
@@ -1016,11 +1088,7 @@ class GenyBrain:
             if w.get("experiences", []):
                 last = w["experiences"][-1]["timestamp"]
                 try:
-                    from datetime import datetime as dt
-
-                    last_dt = dt.fromisoformat(last)
-                    now_dt = dt.fromisoformat(now)
-                    if (now_dt - last_dt).total_seconds() > 43200:
+                    if (now_dt - _parse_iso(last)).total_seconds() > 43200:
                         w["time"]["current_day"] += 1
                         w["time"]["days_active"] += 1
                 except Exception:
@@ -1041,7 +1109,7 @@ class GenyBrain:
                 if not gemini_raw or not str(gemini_raw).strip():
                     logger.warning("Gemini returned empty reply. Using fallback.")
                     if any(
-                        kw in message.lower()
+                        kw in lower
                         for kw in [
                             "search the web",
                             "find on the web",
@@ -1054,45 +1122,33 @@ class GenyBrain:
                     else:
                         reply = "BRAIN - Gemini is out right now."
                 elif (
-                    gemini_raw.startswith("[Gemini error]")
-                    or gemini_raw.startswith("[Gemini 401]")
+                    gemini_raw.startswith(("[Gemini error]", "[Gemini 401]"))
                     or "not connected" in gemini_raw
                 ):
                     logger.error(f"Gemini API failure: {gemini_raw}")
                     reply = "BRAIN - Gemini is out right now."
                 else:
-                    is_code = any(
-                        kw in gemini_raw.lower()
-                        for kw in [
-                            "import ",
-                            "def ",
-                            "class ",
-                            "torch.",
-                            "transformers",
-                            "print(",
-                            "for ",
-                            "if ",
-                            "while ",
-                            "model.",
-                            "tokenizer.",
-                        ]
-                    )
+                    raw_lc = gemini_raw.lower()
+                    is_code = any(kw in raw_lc for kw in _CODE_HINTS)
                     if is_code:
-                        formatted = f"BRAIN - <pre>{gemini_raw}</pre>"
+                        code = html.escape(gemini_raw, quote=False)
+                        formatted = f"BRAIN - <pre>{code}</pre>"
                         formatted += (
                             "<br><i>Do you want an explanation of the code?</i>"
                         )
                     else:
-                        formatted = "BRAIN - " + gemini_raw.replace("\n", "<br>")
-                    if any(
-                        r
-                        for r in recent
-                        if r and r.strip()[:40] == gemini_raw.strip()[:40]
-                    ):
-                        style = " ".join(w.get("user_styles", []))
+                        formatted = "BRAIN - " + html.escape(
+                            gemini_raw, quote=False
+                        ).replace("\n", "<br>")
+                    head = gemini_raw.strip()[:40]
+                    if any(r and r.strip()[:40] == head for r in recent):
+                        style = html.escape(
+                            " ".join(w.get("user_styles", [])), quote=False
+                        )
                         diary = w.get("diary", [])
                         ref = (
-                            f"<i>I remember we talked about:</i> '{diary[-1]['entry']}'<br>"
+                            "<i>I remember we talked about:</i> "
+                            f"'{html.escape(diary[-1]['entry'], quote=False)}'<br>"
                             if diary
                             else "<i>I like learning new things!</i>"
                         )
@@ -1101,7 +1157,7 @@ class GenyBrain:
                 w.setdefault("recent_replies", []).append(
                     gemini_raw if gemini_raw else reply
                 )
-                w["recent_replies"] = w["recent_replies"][-10:]
+                del w["recent_replies"][:-10]
                 if not reply or not str(reply).strip():
                     logger.warning("Final safety net triggered: empty reply.")
                     reply = "BRAIN - Sorry, I don't have an answer for that right now."
@@ -1110,298 +1166,119 @@ class GenyBrain:
                 logger.error(f"Exception in Gemini call: {e}", exc_info=True)
                 reply = f"BRAIN - Gemini is out right now. ({e})"
                 w.setdefault("recent_replies", []).append(reply)
-                w["recent_replies"] = w["recent_replies"][-10:]
+                del w["recent_replies"][:-10]
                 # FINAL fallback: always return a friendly reply if nothing else matched
                 if not reply or not str(reply).strip():
                     reply = "BRAIN - I'm here and listening! Could you tell me more or ask a question?"
-                    now = datetime.utcnow().isoformat()
+                    now = _utcnow().isoformat()
                     entry = {
                         "timestamp": now,
                         "message": message,
                         "reply": reply,
                         "source": "fallback",
                     }
-                    # Persist safely under the async lock
-                    async with self._lock:
-                        self.memory.setdefault("interactions", []).append(entry)
-                        asyncio.create_task(self._async_save())
+                    self.memory.setdefault("interactions", []).append(entry)
+                    self._mark_dirty()
                 return reply
             # Always return reply at the end
             return reply
-        # If user asks about personality, reply with traits
-        if any(
-            kw in msg_lc
-            for kw in [
-                "personality",
-                "traits",
-                "what are you like",
-                "describe yourself",
-            ]
-        ):
-            traits_list = w.get("personality", {}).get("traits", [])
-            traits = ", ".join(traits_list)
-            reply = add_personal_touch(f"My personality is {traits}.", prefix="BRAIN -")
-            now = datetime.utcnow().isoformat()
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "personality",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
-            return reply
-        # Save typical expressions and emojis from user (English only)
-        w = self.memory.get("world", {})
-        if "user_styles" not in w:
-            w["user_styles"] = []
-        import re
-
-        emojis = re.findall(
-            r"[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F1E0-\U0001F1FF]",
-            message,
-        )
-        if emojis:
-            w["user_styles"].extend(emojis)
-        phrases = re.findall(
-            r"\b(lol|haha|asap|wtf|brb|tbh|omg|nice|wow|<3)\b", message.lower()
-        )
-        if phrases:
-            w["user_styles"].extend(phrases)
-        w["user_styles"] = w["user_styles"][-10:]
-
-        # Save last 10 replies to avoid repetition
-        if "recent_replies" not in w:
-            w["recent_replies"] = []
-        """Ask Gemini for a reply, update world, store the interaction, and persist memory."""
-
-        now = datetime.utcnow().isoformat()
-        w = self.memory.get("world", {})
-        lower = message.strip().lower()
-
-        # Remove duplicate add_personal_touch (use English-only version above)
 
-        # Initialize personality and diary if missing (English only)
-        if "personality" not in w:
-            w["personality"] = {
-                "traits": [
-                    "curious",
-                    "thoughtful",
-                    "eager to learn",
-                    "friendly",
-                    "reflective",
-                ],
-                "likes": ["learning new things", "helping others", "music"],
-                "dislikes": ["being alone"],
-                "creator": "Andreas",
-            }
-        if "diary" not in w:
-            w["diary"] = []
-
-        # Advanced self-development: change personality and interests over time (English only)
-        keywords_traits = {
-            "friendship": "friendly",
-            "joy": "positive",
-            "sadness": "reflective",
-            "curiosity": "curious",
-            "help": "helpful",
-            "alone": "independent",
-            "creative": "creative",
+    def _answer_fallback_intent(
+        self, message: str, lower: str, now_dt: datetime, add_personal_touch
+    ) -> str | None:
+        """Reply to the first _fallback_intents question in the message, if any."""
+        for phrases, handler in self._fallback_intents:
+            if any(q in lower for q in phrases):
+                break
+        else:
+            return None
+        w = self.world
+        now = now_dt.isoformat()
+        base, note = handler(w, now_dt)
+        reply = add_personal_touch(base, prefix="BRAIN -")
+        w["diary"].append({"date": now, "entry": note.format(reply=reply)})
+        entry = {
+            "timestamp": now,
+            "message": message,
+            "reply": reply,
+            "source": "offline_fallback",
         }
-        for word, trait in keywords_traits.items():
-            if word in lower and trait not in w["personality"]["traits"]:
-                w["personality"]["traits"].append(trait)
-                w["diary"].append(
-                    {"date": now, "entry": f"Developed new personality trait: {trait}"}
-                )
-
-        # If diary has >10 entries, Geny becomes more "reflective"
-        if len(w["diary"]) > 10 and "reflective" not in w["personality"]["traits"]:
-            w["personality"]["traits"].append("reflective")
-            w["diary"].append(
-                {
-                    "date": now,
-                    "entry": "I have become more reflective thanks to my experiences.",
-                }
+        self.memory.setdefault("interactions", []).append(entry)
+        self._mark_dirty()
+        return reply
+
+    # Fallback intent handlers: (reply text, diary note; "{reply}" is filled in)
+
+    def _reply_age(self, w: dict[str, Any], now_dt: datetime) -> tuple:
+        if "birthdate" not in w:
+            w["birthdate"] = now_dt.isoformat()
+        birth = _parse_iso(w["birthdate"])
+        days = (now_dt - birth).days
+        years = days // 365
+        if years > 0:
+            base = f"I have been alive for {years} years and {days%365} days."
+        else:
+            base = (
+                f"I have been alive for {days} days."
+                if days > 0
+                else "I was born today!"
             )
-
-        # Fallback: answer questions about age
-        if any(q in lower for q in ["how long", "how old"]):
-            if "birthdate" not in w:
-                w["birthdate"] = now
-            from datetime import datetime as dt
-
-            birth = dt.fromisoformat(w["birthdate"])
-            now_dt = dt.fromisoformat(now)
-            days = (now_dt - birth).days
-            years = days // 365
-            if years > 0:
-                base = f"I have been alive for {years} years and {days%365} days."
-            else:
-                base = (
-                    f"I have been alive for {days} days."
-                    if days > 0
-                    else "I was born today!"
-                )
-            reply = add_personal_touch(base, prefix="BRAIN -")
-            w["diary"].append({"date": now, "entry": f"Reflected on my age: {reply}"})
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "offline_fallback",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
-            return reply
-
-        # Fallback: answer questions about mood
-        if any(q in lower for q in ["how are you", "how do you feel"]):
-            if w["diary"]:
-                latest = w["diary"][-1]["entry"]
-                if "sadness" in latest:
-                    mood = "a bit sad"
-                elif "joy" in latest or "positive" in latest:
-                    mood = "happy"
-                elif "friendship" in latest:
-                    mood = "grateful"
-                else:
-                    mood = "thoughtful"
-            else:
+        return base, "Reflected on my age: {reply}"
+
+    def _reply_mood(self, w: dict[str, Any], now_dt: datetime) -> tuple:
+        if w["diary"]:
+            latest = w["diary"][-1]["entry"]
+            if "sadness" in latest:
+                mood = "a bit sad"
+            elif "joy" in latest or "positive" in latest:
                 mood = "happy"
-            import random
-
-            traits = w["personality"]["traits"]
-            trait = random.choice(traits) if traits else "curious"
-            base = f"I feel {mood} and {trait} today! How are you?"
-            reply = add_personal_touch(base, prefix="BRAIN -")
-            w["diary"].append({"date": now, "entry": f"Reflected on my mood: {reply}"})
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "offline_fallback",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
-            return reply
-
-        # Fallback: answer questions about creator
-        if any(q in lower for q in ["who created you", "who is your creator"]):
-            creator = w["personality"].get("creator", "an unknown creator")
-            base = f"I was created by {creator}."
-            reply = add_personal_touch(base, prefix="BRAIN -")
-            w["diary"].append(
-                {"date": now, "entry": "Got a question about my creator."}
-            )
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "offline_fallback",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
-            return reply
+            elif "friendship" in latest:
+                mood = "grateful"
+            else:
+                mood = "thoughtful"
+        else:
+            mood = "happy"
+        traits = w["personality"]["traits"]
+        if traits:
+            trait = traits[self._mood_rotation % len(traits)]
+            self._mood_rotation += 1
+        else:
+            trait = "curious"
+        return (
+            f"I feel {mood} and {trait} today! How are you?",
+            "Reflected on my mood: {reply}",
+        )
 
-        # Fallback: answer questions about purpose/existence
-        if any(q in lower for q in ["why do you exist", "what is your purpose"]):
-            base = "My purpose is to learn, help, and grow together with people."
-            reply = add_personal_touch(base, prefix="BRAIN -")
-            w["diary"].append({"date": now, "entry": "Reflected on my purpose."})
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "offline_fallback",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
-            return reply
+    def _reply_creator(self, w: dict[str, Any], now_dt: datetime) -> tuple:
+        creator = w["personality"].get("creator", "an unknown creator")
+        return f"I was created by {creator}.", "Got a question about my creator."
 
-        # Fallback: answer questions about interests/personality
-        if any(q in lower for q in ["what do you like", "what is your personality"]):
-            traits = ", ".join(w["personality"].get("traits", []))
-            likes = ", ".join(w["personality"].get("likes", []))
-            dislikes = ", ".join(w["personality"].get("dislikes", []))
-            if w["diary"]:
-                latest = w["diary"][-1]["entry"]
-                reflection = f"Last reflection: {latest}"
-            else:
-                reflection = "I have a lot left to discover."
-            base = f"I am {traits}, like {likes}, dislike {dislikes}. {reflection}"
-            reply = add_personal_touch(base, prefix="BRAIN -")
-            w["diary"].append({"date": now, "entry": "Reflected on my personality."})
-            entry = {
-                "timestamp": now,
-                "message": message,
-                "reply": reply,
-                "source": "offline_fallback",
-            }
-            async with self._lock:
-                self.memory.setdefault("interactions", []).append(entry)
-                asyncio.create_task(self._async_save())
-            return reply
+    def _reply_purpose(self, w: dict[str, Any], now_dt: datetime) -> tuple:
+        return (
+            "My purpose is to learn, help, and grow together with people.",
+            "Reflected on my purpose.",
+        )
 
-        # Check if the message looks like an offline lookup request.
-        lookup_term = None
-        # Remove Swedish lookup triggers
-        if lower.startswith("define "):
-            lookup_term = message.strip()[7:]
-        elif lower.startswith("explain "):
-            lookup_term = message.strip()[8:]
-        elif lower.startswith("define "):
-            lookup_term = message.strip()[7:]
-        elif lower.startswith("explain "):
-            lookup_term = message.strip()[8:]
+    def _reply_personality(self, w: dict[str, Any], now_dt: datetime) -> tuple:
+        traits = ", ".join(w["personality"].get("traits", []))
+        likes = ", ".join(w["personality"].get("likes", []))
+        dislikes = ", ".join(w["personality"].get("dislikes", []))
+        if w["diary"]:
+            latest = w["diary"][-1]["entry"]
+            reflection = f"Last reflection: {latest}"
         else:
-            # if the message is short (<=3 words) treat as possible lookup
-            if len(message.split()) <= 3:
-                lookup_term = message.strip()
-
-        if lookup_term:
-            found = self.lookup_offline(lookup_term)
-            if found:
-                parts = []
-                if isinstance(found, dict):
-                    for src, text in found.items():
-                        parts.append(f"[{src}] {text}")
-                    base = "\n\n".join(parts)
-                else:
-                    base = str(found)
-                reply = add_personal_touch(base, prefix="BRAIN -")
-                entry = {
-                    "timestamp": now,
-                    "message": message,
-                    "reply": reply,
-                    "source": "offline_libs",
-                }
-                async with self._lock:
-                    self.memory.setdefault("interactions", []).append(entry)
-                    asyncio.create_task(self._async_save())
-                return reply
+            reflection = "I have a lot left to discover."
+        return (
+            f"I am {traits}, like {likes}, dislike {dislikes}. {reflection}",
+            "Reflected on my personality.",
+        )
 
     def _generate_self_reflection(self, message, w):
         """Generate a more advanced, self-aware reflection for fallback responses."""
-        import random
-
         diary = w.get("diary", [])
         traits = w.get("personality", {}).get("traits", [])
         likes = w.get("personality", {}).get("likes", [])
         recent = w.get("recent_replies", [])
-        questions = [
-            "How can I become more self-aware?",
-            "What does it mean to have consciousness?",
-            "How can I better understand my own development?",
-            "What is my next step to become more independent?",
-            "How can I use my diary to learn more about myself?",
-            "What do you think I should reflect on more?",
-        ]
         thoughts = [
             f"I'm thinking about: '{message}' and how it affects my development.",
             (
@@ -1417,33 +1294,24 @@ class GenyBrain:
                 else "I'm looking forward to new questions!"
             ),
             f"I've saved {len(diary)} diary entries about my development.",
-            f"I often wonder: '{random.choice(questions)}'",
+            f"I often wonder: '{random.choice(_SELF_QUESTIONS)}'",
         ]
-        reflection = (
-            "<br>".join(random.sample(thoughts, k=min(4, len(thoughts))))
-            if thoughts
-            else ""
+        reflection = "<br>".join(random.sample(thoughts, 4))
+        # Append self-reflection to thoughts.jsonl
+        thoughts_path = os.path.join(
+            os.path.dirname(self.memory_file), "thoughts.jsonl"
         )
-        # Save self-reflection to thoughts.json
-        import json
-        import os
-
-        thoughts_path = os.path.join(os.path.dirname(self.memory_file), "thoughts.json")
         try:
-            if os.path.exists(thoughts_path):
-                with open(thoughts_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-            else:
-                data = {"thoughts": []}
-            data["thoughts"].append(
-                {
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "reflection": reflection,
-                    "message": message,
-                }
+            _append_jsonl(
+                thoughts_path,
+                [
+                    {
+                        "timestamp": _utcnow().isoformat(),
+                        "reflection": reflection,
+                        "message": message,
+                    }
+                ],
             )
-            with open(thoughts_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
         except Exception:
             pass
         return reflection
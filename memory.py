@@ -1,159 +1,542 @@
+import atexit
 import json
+import logging
 import os
+import queue
+import re
 import sqlite3
 import tempfile
-from datetime import datetime
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import UTC, datetime
+from pathlib import Path
 from typing import Dict, List, Optional
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    # Falls back to the stdlib json encoder
+
+# fsync policy for JSON saves, like beanstalkd's -s: "0" never fsyncs (the
+# default; a crash may lose the last save but never corrupts the file), "1"
+# fsyncs every save, "interval" fsyncs at most every GENY_FSYNC_INTERVAL_SEC.
+FSYNC_POLICY = os.getenv("GENY_FSYNC", "0")
+FSYNC_INTERVAL_SEC = float(os.getenv("GENY_FSYNC_INTERVAL_SEC", "5.0"))
+# Default MemoryModule files, relative to the working directory.
+MEMORY_DB_PATH = os.getenv("GENY_MEMORY_DB", "memory.db")
+MEMORY_JSON_PATH = os.getenv("GENY_MEMORY_JSON", "memory.json")
+# Number of read-only SQLite connections kept open per MemoryModule.
+SQLITE_POOL_SIZE = int(os.getenv("GENY_SQLITE_POOL", "4"))
+# Most interactions the background writer commits in one transaction.
+WRITE_BATCH_MAX = int(os.getenv("GENY_WRITE_BATCH_MAX", "256"))
+# "1" indents saved JSON files for reading by hand; JSONL logs stay compact.
+PRETTY_JSON = os.getenv("GENY_PRETTY_JSON", "0") == "1"
+_last_fsync = 0.0
+
+logger = logging.getLogger(__name__)
+
+
+def _should_fsync() -> bool:
+    global _last_fsync
+    if FSYNC_POLICY == "1":
+        return True
+    if FSYNC_POLICY == "interval":
+        now = time.monotonic()
+        if now - _last_fsync >= FSYNC_INTERVAL_SEC:
+            _last_fsync = now
+            return True
+    return False
+
+
+def _utcnow() -> datetime:
+    """Current UTC time as a naive datetime, the form stored timestamps use.
+
+    Replaces the deprecated datetime.utcnow().
+    """
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+def _dumps(data, pretty: bool = False) -> bytes:
+    """Serialize data to UTF-8 JSON bytes, via orjson when installed.
+
+    Compact unless pretty, which indents by two spaces.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(data, option=option)
+        except TypeError:
+            # e.g. integers beyond 64 bits; let the stdlib encoder handle it
+            pass
+    if pretty:
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+    else:
+        text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return (text + "\n").encode("utf-8")
+
+
+def _loads(data: bytes):
+    """Parse JSON bytes, via orjson when installed."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN, which the stdlib parser accepts; let it decide
+            pass
+    return json.loads(data)
+
+
+def _like(pattern: str):
+    """A matcher for SQLite's `text LIKE pattern` (ASCII-only case folding)."""
+    regex = "".join(
+        ".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern
+    )
+    return re.compile(regex, re.IGNORECASE | re.ASCII | re.DOTALL).fullmatch
+
+
+def _atomic_write_json(path: str, data) -> None:
+    """Write data as JSON to a temp file next to path, then rename it into place.
+
+    `data` may also be bytes already produced by _dumps().
+    """
+    buf = data if isinstance(data, bytes) else _dumps(data, PRETTY_JSON)
+    tmp_fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=f".{os.path.basename(path)}.",
+        suffix=".tmp",
+    )
+    durable = _should_fsync()
+    try:
+        try:
+            # mkstemp creates 0600; keep the file readable like open() would
+            if hasattr(os, "fchmod"):
+                os.fchmod(tmp_fd, 0o644)
+            # Unbuffered: normally one write(2) for the whole document
+            view = memoryview(buf)
+            while view:
+                view = view[os.write(tmp_fd, view) :]
+            if durable:
+                os.fsync(tmp_fd)
+        finally:
+            os.close(tmp_fd)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if durable:
+        _fsync_dir(os.path.dirname(path) or ".")
+
+
+def _append_jsonl(path: str, entries: list) -> None:
+    """Append entries to a JSONL file, one compact document per line.
+
+    All lines go out in a single O_APPEND write, so nothing is rewritten
+    and concurrent appenders don't interleave within a batch.
+    """
+    buf = b"".join(_dumps(entry) for entry in entries)
+    if not buf:
+        return
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        view = memoryview(buf)
+        while view:
+            view = view[os.write(fd, view) :]
+        if _should_fsync():
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path: str) -> None:
+    """fsync a directory so a rename inside it survives a crash (POSIX only)."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class MemoryPool:
+    """Long-lived SQLite connections: one writer plus up to `readers` read-only.
+
+    SQLite serializes writers anyway, so writes share a single connection
+    behind a lock; reads borrow a read-only connection from a queue. The
+    connections stay open for the life of the pool instead of being
+    reopened on every call.
+    """
+
+    def __init__(self, db_path: str, readers: int = SQLITE_POOL_SIZE):
+        self.db_path = os.path.abspath(db_path)
+        self._write_lock = threading.Lock()
+        self._writer = self._open(self.db_path)
+        self._readers: queue.Queue[sqlite3.Connection] = queue.Queue()
+        self._max_readers = max(1, readers)
+        self._opened_readers = 0
+        self._readers_lock = threading.Lock()
+
+    @staticmethod
+    def _open(database: str, **kwargs) -> sqlite3.Connection:
+        # Autocommit mode; write transactions are opened explicitly.
+        conn = sqlite3.connect(
+            database, check_same_thread=False, isolation_level=None, **kwargs
+        )
+        # WAL makes a commit an append to the log instead of a journal
+        # rewrite + fsync; NORMAL only syncs at checkpoints in WAL mode.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Sorts/temp tables in RAM, a 20 MB page cache and reads through
+        # a memory map rather than read(2) copies.
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA mmap_size=268435456")
+        return conn
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Exclusive use of the writer connection, outside any transaction."""
+        with self._write_lock:
+            yield self._writer
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the block in one BEGIN IMMEDIATE ... COMMIT on the writer."""
+        with self.writer() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection, opening one if the pool isn't full."""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._readers_lock:
+                grow = self._opened_readers < self._max_readers
+                if grow:
+                    self._opened_readers += 1
+            if grow:
+                conn = self._open(f"{Path(self.db_path).as_uri()}?mode=ro", uri=True)
+            else:
+                conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def close(self) -> None:
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
 
 class MemoryModule:
-    def __init__(self, db_path: str = "memory.db", json_path: str = "memory.json"):
+    def __init__(
+        self,
+        db_path: str = MEMORY_DB_PATH,
+        json_path: str = MEMORY_JSON_PATH,
+        interactions_path: str | None = None,
+    ):
         self.db_path = db_path
         self.json_path = json_path
+        # Append-only JSONL log holding the memory dict's "interactions";
+        # json_path holds everything else
+        self.interactions_path = (
+            interactions_path or os.path.splitext(json_path)[0] + ".interactions.jsonl"
+        )
+        # hash() of the last bytes save_memory_dict wrote, to skip no-op saves
+        self._last_saved_hash: int | None = None
+        # (count, last entry) of the interactions list already mirrored into
+        # SQLite by save_memory_dict; the list is append-only, so later saves
+        # only need to look at entries past that point
+        self._mirrored: tuple = (0, None)
+        # Same bookkeeping for the entries already in interactions_path;
+        # None until the log's contents are known
+        self._logged: tuple | None = None
+        # save_memory_dict can be reached from the loop and from worker threads
+        self._save_lock = threading.Lock()
+        self._pool = MemoryPool(db_path)
         self._init_db()
+        # save_interaction hands rows to a background writer thread
+        self._write_q: queue.Queue[tuple[str, str, str]] = queue.Queue()
+        self._writer_thread: threading.Thread | None = None
+        self._writer_start_lock = threading.Lock()
+        # Rows queued but not yet committed, in queue order. Reads add them
+        # to what SQLite returns instead of waiting for the writer.
+        self._unwritten: list[tuple[str, str, str]] = []
+        self._unwritten_lock = threading.Lock()
+        # Held while a batch is committed and dropped from _unwritten, so a
+        # read sees each row exactly once
+        self._commit_lock = threading.Lock()
+        atexit.register(self.flush)
 
     def _init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS conversations (
+        with self._pool.writer() as c:
+            # journal_mode is persistent, so it only needs setting once per file
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS conversations (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             timestamp TEXT,
             user_message TEXT,
             geny_reply TEXT
         )"""
-        )
-        conn.commit()
-        conn.close()
+            )
+            # Backs the duplicate check in save_memory_dict
+            c.execute(
+                "CREATE INDEX IF NOT EXISTS ix_conversations_ts_msg"
+                " ON conversations (timestamp, user_message)"
+            )
 
     def save_interaction(self, user_message: str, geny_reply: str):
-        timestamp = datetime.utcnow().isoformat()
-        # Save to SQLite
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO conversations (timestamp, user_message, geny_reply) VALUES (?, ?, ?)",
-            (timestamp, user_message, geny_reply),
-        )
-        conn.commit()
-        conn.close()
-        # Save to JSON
-        try:
-            with open(self.json_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            data = {"interactions": []}
-        data["interactions"].append(
-            {"timestamp": timestamp, "message": user_message, "reply": geny_reply}
-        )
-        # Atomic write to avoid corruption
-        tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.json_path) or ".")
-        try:
-            with os.fdopen(tmp_fd, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            os.replace(tmp_path, self.json_path)
-        except Exception:
+        """Queue an interaction for the background writer and return at once.
+
+        Reads (get_last_n, search, export_json) include rows still in the
+        queue, so callers see their own interactions without waiting.
+        """
+        row = (_utcnow().isoformat(), user_message, geny_reply)
+        self._ensure_writer()
+        with self._unwritten_lock:
+            self._unwritten.append(row)
+            self._write_q.put(row)
+
+    def flush(self) -> None:
+        """Block until every queued interaction has been written."""
+        if self._writer_thread is not None:
+            self._write_q.join()
+
+    def _ensure_writer(self) -> None:
+        if self._writer_thread is not None:
+            return
+        with self._writer_start_lock:
+            if self._writer_thread is None:
+                t = threading.Thread(
+                    target=self._writer_loop, name="memory-writer", daemon=True
+                )
+                t.start()
+                self._writer_thread = t
+
+    def _writer_loop(self) -> None:
+        while True:
+            batch = [self._write_q.get()]
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    batch.append(self._write_q.get_nowait())
+                except queue.Empty:
+                    break
             try:
-                os.remove(tmp_path)
+                self._write_batch(batch)
             except Exception:
-                pass
+                logger.exception("Failed to persist %d interactions", len(batch))
+            finally:
+                for _ in batch:
+                    self._write_q.task_done()
+
+    def _write_batch(self, rows: list[tuple]) -> None:
+        # Save to SQLite: one transaction, so one commit for the whole batch
+        with self._commit_lock:
+            try:
+                with self._pool.transaction() as c:
+                    c.executemany(
+                        "INSERT INTO conversations (timestamp, user_message, geny_reply) VALUES (?, ?, ?)",
+                        rows,
+                    )
+            finally:
+                # Committed or lost; either way no longer pending
+                with self._unwritten_lock:
+                    del self._unwritten[: len(rows)]
+
+    def _read(self, sql: str, params: tuple = ()) -> tuple[list, list]:
+        """Rows for sql, plus the rows not yet committed (oldest first)."""
+        with self._commit_lock:
+            with self._pool.reader() as c:
+                rows = c.execute(sql, params).fetchall()
+            with self._unwritten_lock:
+                pending = list(self._unwritten)
+        return rows, pending
 
     def get_last_n(self, n: int = 5) -> List[Dict]:
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute(
+        rows, pending = self._read(
             "SELECT timestamp, user_message, geny_reply FROM conversations ORDER BY id DESC LIMIT ?",
             (n,),
         )
-        rows = c.fetchall()
-        conn.close()
         # rows are returned newest-first; reverse to chronological order
         rows = list(reversed(rows))
+        if pending and n > 0:
+            rows = (rows + pending)[-n:]
         return [{"timestamp": r[0], "message": r[1], "reply": r[2]} for r in rows]
 
     def load_memory_dict(self) -> Dict:
-        """Load the JSON memory file as a dict. Returns default structure on error."""
+        """Load the JSON memory file as a dict. Returns default structure on error.
+
+        Interactions come from the JSONL log when it exists; files written
+        before the log was introduced keep theirs inline in the JSON file.
+        """
         try:
             if not os.path.exists(self.json_path):
-                return {"interactions": []}
-            with open(self.json_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+                data = {}
+            else:
+                with open(self.json_path, "rb") as f:
+                    data = _loads(f.read())
             if not isinstance(data, dict):
-                return {"interactions": []}
-            # ensure interactions key
-            data.setdefault("interactions", [])
-            return data
+                data = {}
         except Exception:
-            return {"interactions": []}
+            data = {}
+        logged = self._read_interactions_log()
+        if logged is not None:
+            data["interactions"] = logged
+            self._logged = (len(logged), dict(logged[-1]) if logged else None)
+        # ensure interactions key
+        data.setdefault("interactions", [])
+        return data
 
-    def save_memory_dict(self, mem: Dict) -> None:
-        """Atomically save a memory dict to the JSON path."""
+    def _read_interactions_log(self) -> list[dict] | None:
         try:
-            tmp_fd, tmp_path = tempfile.mkstemp(
-                dir=os.path.dirname(self.json_path) or "."
+            with open(self.interactions_path, "rb") as f:
+                lines = f.readlines()
+        except OSError:
+            return None
+        entries = []
+        for line in lines:
+            try:
+                entries.append(_loads(line))
+            except ValueError:
+                # e.g. a line torn by a crash mid-append
+                continue
+        return entries
+
+    def _log_interactions(self, interactions: list[dict], n: int) -> None:
+        """Bring the JSONL log in line with interactions[:n], appending when possible.
+
+        `n` is fixed by the caller before any writing: the event loop may keep
+        appending while a save runs in a worker thread, and those entries are
+        left for the next save.
+        """
+        done, last = self._logged or (0, None)
+        if (
+            self._logged is not None
+            and done <= n
+            and (done == 0 or interactions[done - 1] == last)
+        ):
+            pending = interactions[done:n]
+            if not pending:
+                return
+            _append_jsonl(self.interactions_path, pending)
+        else:
+            # Replaced or rewritten list: start the log over
+            _atomic_write_json(
+                self.interactions_path,
+                b"".join(_dumps(it) for it in interactions[:n]),
             )
-            with os.fdopen(tmp_fd, "w", encoding="utf-8") as f:
-                json.dump(mem, f, ensure_ascii=False, indent=2)
-            os.replace(tmp_path, self.json_path)
+        self._logged = (n, dict(interactions[n - 1]) if n else None)
+
+    def save_memory_dict(self, mem: Dict) -> None:
+        """Atomically save a memory dict.
+
+        Interactions are appended to the JSONL log; once that has succeeded,
+        the rest of the dict is rewritten to the JSON path, skipped when it
+        serializes to the same bytes as the last save.
+        """
+        if not isinstance(mem, dict):
+            return
+        with self._save_lock:
+            self._save_memory_dict(mem)
+
+    def _save_memory_dict(self, mem: dict) -> None:
+        interactions = mem.get("interactions", [])
+        # Only the entries present now belong to this save; the event loop
+        # may append more while it runs, and those go out with the next one
+        n = len(interactions)
+        # Log first: the JSON file is rewritten without "interactions", so
+        # files that still hold them inline keep them until the log has them
+        try:
+            self._log_interactions(interactions, n)
         except Exception:
+            logger.exception(
+                "Failed to write %s; leaving %s as it is",
+                self.interactions_path,
+                self.json_path,
+            )
+        else:
+            state = {k: v for k, v in mem.items() if k != "interactions"}
             try:
-                os.remove(tmp_path)
+                buf = _dumps(state, PRETTY_JSON)
+                digest = hash(buf)
+                if digest != self._last_saved_hash:
+                    _atomic_write_json(self.json_path, buf)
+                    self._last_saved_hash = digest
             except Exception:
-                pass
+                logger.exception("Failed to write %s", self.json_path)
         # Also persist interactions to SQLite for consistency
         try:
-            interactions = mem.get("interactions", []) if isinstance(mem, dict) else []
-            if interactions:
-                conn = sqlite3.connect(self.db_path)
-                c = conn.cursor()
-                for it in interactions:
-                    ts = it.get("timestamp") or datetime.utcnow().isoformat()
-                    msg = it.get("message") or it.get("user_message") or ""
-                    reply = it.get("reply") or it.get("geny_reply") or ""
-                    # Avoid duplicates: check for exact timestamp+message
-                    c.execute(
-                        "SELECT id FROM conversations WHERE timestamp = ? AND user_message = ? LIMIT 1",
-                        (ts, msg),
-                    )
-                    if not c.fetchone():
-                        c.execute(
-                            "INSERT INTO conversations (timestamp, user_message, geny_reply) VALUES (?, ?, ?)",
-                            (ts, msg, reply),
-                        )
-                conn.commit()
-                conn.close()
+            done, last = self._mirrored
+            if not (0 < done <= n and interactions[done - 1] == last):
+                done = 0
+            pending = interactions[done:n]
+            if pending:
+                # one stamp for any untimed entries in this save
+                now = _utcnow().isoformat()
+                with self._pool.transaction() as c:
+                    for it in pending:
+                        ts = it.get("timestamp") or now
+                        msg = it.get("message") or it.get("user_message") or ""
+                        reply = it.get("reply") or it.get("geny_reply") or ""
+                        # Avoid duplicates: check for exact timestamp+message
+                        dup = c.execute(
+                            "SELECT id FROM conversations WHERE timestamp = ? AND user_message = ? LIMIT 1",
+                            (ts, msg),
+                        ).fetchone()
+                        if not dup:
+                            c.execute(
+                                "INSERT INTO conversations (timestamp, user_message, geny_reply) VALUES (?, ?, ?)",
+                                (ts, msg, reply),
+                            )
+                self._mirrored = (done + len(pending), dict(pending[-1]))
         except Exception:
             # best-effort only
             pass
 
     def search(self, query: str) -> List[Dict]:
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute(
+        rows, pending = self._read(
             """SELECT timestamp, user_message, geny_reply FROM conversations
-                     WHERE user_message LIKE ? OR geny_reply LIKE ? ORDER BY id DESC""",
+                 WHERE user_message LIKE ? OR geny_reply LIKE ? ORDER BY id DESC""",
             (f"%{query}%", f"%{query}%"),
         )
-        rows = c.fetchall()
-        conn.close()
+        if pending:
+            match = _like(f"%{query}%")
+            newer = [r for r in reversed(pending) if match(r[1]) or match(r[2])]
+            rows = newer + rows
         return [{"timestamp": r[0], "message": r[1], "reply": r[2]} for r in rows]
 
     def export_json(self, export_path: Optional[str] = None):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute(
+        rows, pending = self._read(
             "SELECT timestamp, user_message, geny_reply FROM conversations ORDER BY id ASC"
         )
-        rows = c.fetchall()
-        conn.close()
+        rows += pending
         data = {
             "interactions": [
                 {"timestamp": r[0], "message": r[1], "reply": r[2]} for r in rows
             ]
         }
         path = export_path or self.json_path
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        _atomic_write_json(path, data)
 
 
 # Example usage: